@@ -7,15 +7,24 @@
 """
 
 __all__ = [
+    'addon_utils',
+    'catalogue_utils',
     'common',
     'constants',
     'datafunctions',
+    'directory_cache_utils',
+    'explorer_utils',
     'gui',
     'hash_utils',
     'jsonrpc',
+    'kodiwalk_utils',
     'library',
+    'library_cache_utils',
+    'listitem_utils',
     'nodefunctions',
+    'playlist_utils',
     'property_utils',
+    'rpc_stats_utils',
     'skinshortcuts',
     'template',
     'xmlfunctions',
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+    Copyright (C) 2013-2021 Skin Shortcuts (script.skinshortcuts)
+    This file is part of script.skinshortcuts
+    SPDX-License-Identifier: GPL-2.0-only
+    See LICENSES/GPL-2.0-only.txt for more information.
+"""
+
+import json
+import os
+import traceback
+import xml.etree.ElementTree as ETree
+
+import xbmcvfs
+
+from .common import log
+from .common import read_file
+from .common import write_file
+from .constants import ADDON_INDEX_FILE
+
+
+def read_addon_index():
+    # The index holds, for each add-on whose addon.xml we've read, its version and the modified
+    # time of its addon.xml, the extension points it has, and the content its plugin provides
+    if xbmcvfs.exists(ADDON_INDEX_FILE):
+        try:
+            return json.loads(read_file(ADDON_INDEX_FILE))
+        except:
+            log(traceback.print_exc())
+            log("Unable to parse %s" % ADDON_INDEX_FILE)
+
+    return {}
+
+
+def write_addon_index(index):
+    try:
+        write_file(ADDON_INDEX_FILE, json.dumps(index))
+    except:
+        log(traceback.print_exc())
+        log('Failed to write add-on index to %s' % ADDON_INDEX_FILE)
+
+
+def read_manifest(path):
+    # Return the extension points of an add-on, and the content types its plugin entry
+    # point provides, by parsing its addon.xml file
+    points = []
+    provides = None
+
+    tree = ETree.parse(os.path.join(path, "addon.xml")).getroot()
+    for extension in tree.findall("extension"):
+        if "point" not in extension.attrib:
+            continue
+
+        points.append(extension.attrib.get("point"))
+        if provides is None and extension.attrib.get("point") == "xbmc.python.pluginsource":
+            # Find out what content type it provides
+            provides = []
+            provides_elem = extension.find("provides")
+            if provides_elem is not None:
+                provides = (provides_elem.text or "").split()
+
+    return points, provides or []
+
+
+def get_plugin_provides(addon_id, version, path, index, seen):
+    # Return the content types an add-on's plugin entry point provides - from the index, unless
+    # the add-on has changed since its addon.xml was last read. What's returned is also added to
+    # seen, which is what should be saved as the next index
+    try:
+        mtime = os.path.getmtime(os.path.join(path, "addon.xml"))
+        key = [version, mtime]
+        if addon_id in index and index[addon_id]["key"] == key:
+            seen[addon_id] = index[addon_id]
+            return index[addon_id]["provides"]
+
+        points, provides = read_manifest(path)
+        seen[addon_id] = {
+            "key": key,
+            "points": points,
+            "provides": provides
+        }
+        return provides
+
+    except:
+        log(traceback.print_exc())
+
+    return []
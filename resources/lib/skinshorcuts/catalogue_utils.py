@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+    Copyright (C) 2013-2021 Skin Shortcuts (script.skinshortcuts)
+    This file is part of script.skinshortcuts
+    SPDX-License-Identifier: GPL-2.0-only
+    See LICENSES/GPL-2.0-only.txt for more information.
+"""
+
+import json
+import os
+import traceback
+
+import xbmcvfs
+
+from .common import log
+from .common import read_file
+from .common import write_file
+from .constants import CATALOGUE_FILE
+from .hash_utils import read_hashes
+
+
+def parse_hashes(hashes):
+    # Return whether the menu described by a hash list can be imported, and the skin it's for
+    can_import = False
+    skin_name = ""
+
+    for _hash in hashes:
+        if _hash[0] == "::FULLMENU::":
+            can_import = True
+            if skin_name:
+                return True, skin_name
+
+        if _hash[0] == "::SKINDIR::":
+            skin_name = _hash[1]
+            if can_import is True:
+                return True, skin_name
+
+    return can_import, skin_name
+
+
+def read_catalogue(catalogue_file=None):
+    # The catalogue records, for the directory it's in, each skin's full menu flag
+    # and all of the .DATA.xml files - so the import dialog doesn't have to parse every .hash
+    if not catalogue_file:
+        catalogue_file = CATALOGUE_FILE
+
+    if xbmcvfs.exists(catalogue_file):
+        try:
+            payload = json.loads(read_file(catalogue_file))
+            if "skins" in payload and "files" in payload:
+                return payload
+        except:
+            log(traceback.print_exc())
+
+        log("Unable to parse %s, rebuilding it" % catalogue_file)
+
+    # No (usable) catalogue yet, so build one from the hash files in the directory
+    return update_catalogue(catalogue_file=catalogue_file)
+
+
+def write_catalogue(data, catalogue_file=None):
+    if not catalogue_file:
+        catalogue_file = CATALOGUE_FILE
+
+    try:
+        payload = json.dumps(data, indent=4)
+        write_file(catalogue_file, payload)
+    except:
+        log(traceback.print_exc())
+        log('Failed to write catalogue to %s' % catalogue_file)
+
+
+def update_catalogue(hashes=None, catalogue_file=None):
+    # Refresh the list of .DATA.xml files in the catalogue and, if we've been passed the
+    # hash list of a menu we've just built, the full menu flag of its skin
+    if not catalogue_file:
+        catalogue_file = CATALOGUE_FILE
+
+    path = os.path.dirname(catalogue_file)
+
+    skins = None
+    if xbmcvfs.exists(catalogue_file):
+        try:
+            skins = json.loads(read_file(catalogue_file))["skins"]
+        except:
+            skins = None
+
+    data_files = []
+    hash_files = []
+    if xbmcvfs.exists(path):
+        for files in xbmcvfs.listdir(path):
+            for file in files:
+                if file.endswith(".DATA.xml"):
+                    data_files.append(file)
+                elif file.endswith(".hash"):
+                    hash_files.append(file)
+
+    if skins is None:
+        skins = {}
+
+    if hashes is not None:
+        can_import, skin_name = parse_hashes(hashes)
+        hash_file = "%s.hash" % skin_name
+        skins[skin_name or hash_file] = {
+            "name": skin_name,
+            "hash": hash_file,
+            "fullmenu": can_import
+        }
+
+    # Parse any hash files that aren't in the catalogue yet. Those without a skin are kept
+    # under the name of their hash file, so they don't replace each other
+    known_hash_files = [skin["hash"] for skin in skins.values()]
+    for hash_file in hash_files:
+        if hash_file not in known_hash_files:
+            can_import, skin_name = parse_hashes(read_hashes(os.path.join(path, hash_file)))
+            skins[skin_name or hash_file] = {
+                "name": skin_name,
+                "hash": hash_file,
+                "fullmenu": can_import
+            }
+
+    # Forget any skin whose hash file has gone
+    skins = dict((skin_name, skin) for skin_name, skin in skins.items()
+                 if skin["hash"] in hash_files)
+
+    for skin_name, skin in skins.items():
+        skin_name = skin.get("name", skin_name)
+        skin["files"] = [file for file in data_files if file.startswith("%s-" % skin_name)]
+
+    catalogue = {
+        "skins": skins,
+        "files": data_files
+    }
+    write_catalogue(catalogue, catalogue_file)
+
+    return catalogue
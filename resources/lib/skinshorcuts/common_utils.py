@@ -6,6 +6,7 @@
     See LICENSES/GPL-2.0-only.txt for more information.
 """
 
+import threading
 from traceback import print_exc
 
 import xbmc
@@ -28,6 +29,10 @@ class ShowDialog(xbmcgui.WindowXMLDialog):
         self.listing = kwargs.get('listing')
         self.window_title = kwargs.get('window_title')
         self.more = kwargs.get('more')
+        # Pages of further listitems, which are added to the listing as they're listed
+        self.pages = kwargs.get('pages')
+        self.pages_thread = None
+        self.closing = False
         self.result = -1
         self.list = None
 
@@ -51,7 +56,21 @@ class ShowDialog(xbmcgui.WindowXMLDialog):
         except RuntimeError:
             pass
 
-        for item in self.listing:
+        self.add_items(self.listing)
+
+        self.setFocus(self.list)
+
+        if self.pages is not None and self.pages_thread is None:
+            self.pages_thread = threading.Thread(target=self.add_pages)
+            self.pages_thread.daemon = True
+            self.pages_thread.start()
+
+    def add_items(self, items):
+        for item in items:
+            if self.closing:
+                # The list belongs to a dialog which has been closed
+                return
+
             listitem = xbmcgui.ListItem(label=item.getLabel(), label2=item.getLabel2(),
                                         offscreen=True)
             listitem.setArt({
@@ -61,11 +80,30 @@ class ShowDialog(xbmcgui.WindowXMLDialog):
             listitem.setProperty('Addon.Summary', item.getLabel2())
             self.list.addItem(listitem)
 
-        self.setFocus(self.list)
+    def add_pages(self):
+        try:
+            while not self.closing:
+                page = next(self.pages, None)
+                if page is None or self.closing:
+                    break
+
+                self.listing.extend(page)
+                self.add_items(page)
+        except:
+            log(print_exc())
+
+    def stop_pages(self, wait=False):
+        # Stop adding pages once the page being listed is done (closing the dialog has already
+        # stopped them being added to the list). If we wait for it, what's left of them can be
+        # picked up by whoever passed them to us
+        self.closing = True
+        if wait and self.pages_thread is not None:
+            self.pages_thread.join()
 
     def onAction(self, action):  # pylint: disable=invalid-name
         if action.getId() in (9, 10, 92, 216, 247, 257, 275, 61467, 61448,):
             self.result = -1
+            self.closing = True
             self.close()
 
     def onClick(self, control_id):  # pylint: disable=invalid-name
@@ -77,6 +115,7 @@ class ShowDialog(xbmcgui.WindowXMLDialog):
         else:
             self.result = -1
 
+        self.closing = True
         self.close()
 
     def onFocus(self, control_id):  # pylint: disable=invalid-name
@@ -33,5 +33,12 @@ KODI_PATH = xbmcvfs.translatePath("special://xbmc/")
 SKIN_DIR = xbmc.getSkinDir()
 PROPERTIES_FILE = os.path.join(DATA_PATH, "%s.properties" % SKIN_DIR)
 HASH_FILE = os.path.join(MASTER_PATH, "%s.hash" % SKIN_DIR)
+TEMPLATE_MEMO_FILE = os.path.join(MASTER_PATH, "%s.templates" % SKIN_DIR)
+LIBRARY_CACHE_FILE = os.path.join(DATA_PATH, "%s.library" % SKIN_DIR)
+PLAYLIST_INDEX_FILE = os.path.join(DATA_PATH, "playlists.index")
+ADDON_INDEX_FILE = os.path.join(DATA_PATH, "addons.index")
+RPC_STATS_FILE = os.path.join(DATA_PATH, "jsonrpc.stats")
+CATALOGUE_FILE = os.path.join(DATA_PATH, "menus.catalogue")
+MASTER_CATALOGUE_FILE = os.path.join(MASTER_PATH, "menus.catalogue")
 LANGUAGE = ADDON.getLocalizedString
 HOME_WINDOW = xbmcgui.Window(10000)
@@ -18,6 +18,9 @@ import xbmcvfs
 from unidecode import unidecode
 
 from . import nodefunctions
+from .catalogue_utils import parse_hashes
+from .catalogue_utils import read_catalogue
+from .catalogue_utils import update_catalogue
 from .common import log
 from .constants import ADDON
 from .constants import ADDON_ID
@@ -50,6 +53,11 @@ class DataFunctions:
 
         self.overrides = {}
 
+        # The <icon /> overrides of each overrides tree, indexed by what they match, and
+        # whether the skin has each image we've asked about
+        self.icon_indexes = {}
+        self.skin_images = {}
+
         self.widget_name_and_type = {}
         self.background_name = {}
         self.fallback_properties = {}
@@ -60,6 +68,8 @@ class DataFunctions:
         self.current_properties = None
         self.default_properties = None
 
+        self.version_equivalency = None
+
         self.property_information = {
             "fallbackProperties": {},
             "fallbacks": {},
@@ -486,30 +496,69 @@ class DataFunctions:
                 # management directory when using this skin
                 ETree.SubElement(required_shortcut, "lock").text = SKIN_DIR
 
-    @staticmethod
-    def icon_override(tree, icon, group, label_id):
+    def icon_override(self, tree, icon, group, label_id):
         old_icon = None
         new_icon = icon
 
         if tree is not None:
-            for elem in tree.findall("icon"):
-                if old_icon is not None:
-                    continue
+            # LabelID (or image) matched, and group also matches or there's no group
+            override = self.find_icon_override(tree, ("group", "grouping", group), label_id,
+                                               icon)
+            if override is not None:
+                old_icon = icon
+                new_icon = override[1]
+
+        return old_icon, new_icon
 
-                if elem.attrib.get("labelID") == label_id or elem.attrib.get("image") == icon:
-                    # LabelID matched
-                    if "group" in elem.attrib:
-                        if elem.attrib.get("group") == group:
-                            # Group also matches - change icon
-                            old_icon = icon
-                            new_icon = elem.text
+    def get_icon_index(self, tree, qualifier, other_qualifier):
+        # Returns the <icon /> overrides of a tree, keyed by what they match - their labelID or
+        # image, and the value of their qualifier attribute (group or grouping). Icons with
+        # only the other qualifier are never matched, so are left out
+        if (tree, qualifier) in self.icon_indexes:
+            return self.icon_indexes[(tree, qualifier)]
+
+        index = {}
+        for position, elem in enumerate(tree.findall("icon")):
+            if qualifier in elem.attrib:
+                qualified = (True, elem.attrib.get(qualifier))
+            elif other_qualifier in elem.attrib:
+                continue
+            else:
+                qualified = (False, None)
+
+            # Only the first matching icon is used, so only the first of each is kept
+            for attrib in ("labelID", "image"):
+                key = (attrib, elem.attrib.get(attrib)) + qualified
+                if key not in index:
+                    index[key] = (position, elem.text)
+
+        self.icon_indexes[(tree, qualifier)] = index
+        return index
+
+    def find_icon_override(self, tree, qualifier, label_id, image):
+        # Returns the position and text of the first <icon /> override which matches the
+        # labelID or image, and either has the qualifier with that value or no qualifier.
+        # qualifier is the qualifier attribute, the other one and the value to match
+        qualifier, other_qualifier, qualifier_value = qualifier
+        index = self.get_icon_index(tree, qualifier, other_qualifier)
+
+        keys = [("labelID", label_id, False, None), ("image", image, False, None)]
+        if qualifier_value is not None:
+            keys += [("labelID", label_id, True, qualifier_value),
+                     ("image", image, True, qualifier_value)]
+
+        matches = [index[key] for key in keys if key in index]
+        if not matches:
+            return None
 
-                    elif "grouping" not in elem.attrib:
-                        # No group - change icon
-                        old_icon = icon
-                        new_icon = elem.text
+        return min(matches, key=lambda match: match[0])
 
-        return old_icon, new_icon
+    def skin_has_image(self, image):
+        # Ask Kodi whether the skin has an image, once per image
+        if image not in self.skin_images:
+            self.skin_images[image] = xbmc.skinHasImage(image)
+
+        return self.skin_images[image]
 
     def _get_icon_overrides(self, tree, icon, group, label_id, set_to_default=True):
         # This function will get any icon overrides based on label_id or group
@@ -522,7 +571,8 @@ class DataFunctions:
 
         _, new_icon = self.icon_override(tree, icon, group, label_id)
 
-        if not (xbmc.skinHasImage(new_icon) or xbmcvfs.exists(new_icon)) and set_to_default is True:
+        if not (self.skin_has_image(new_icon) or xbmcvfs.exists(new_icon)) and \
+                set_to_default is True:
             new_icon = self._get_icon_overrides(tree, "DefaultShortcut.png", group, label_id, False)
 
         return new_icon
@@ -1074,55 +1124,80 @@ class DataFunctions:
     def check_version_equivalency(self, action, check_type="shortcuts"):
         # Check whether the version specified for a shortcut has an equivalency
         # to the version of Kodi we're running
-        trees = [self.get_overrides_skin(), self.get_overrides_script()]
-
-        # Set up so we can handle both groupings and shortcuts in one
-        find_elem = ""
-        find_attrib = ""
         if check_type == "shortcuts":
-            if action is None:
+            if action is None or action.text is None:
                 action = ""
             else:
                 action = action.text
 
-            find_elem = "shortcutEquivalent"
-            find_attrib = "action"
-
         elif check_type == "groupings":
             if action is None:
                 action = ""
-            find_elem = "groupEquivalent"
-            find_attrib = "condition"
 
-        if not find_elem or not find_attrib:
+        else:
             return False
 
-        for tree in trees:
-            if tree.find("versionEquivalency") is None:
-                continue
+        equivalents, matches_all = self.get_version_equivalency()[check_type]
+        return equivalents.get(action.lower(), matches_all)
 
-            for elem in tree.find("versionEquivalency").findall(find_elem):
-                if elem.attrib.get(find_attrib) is not None and \
-                        elem.attrib.get(find_attrib).lower() != action.lower():
-                    # Action's don't match
-                    continue
-                if int(elem.attrib.get("version")) > int(KODI_VERSION):
-                    # This version of Kodi is older than the shortcut is intended for
+    def get_version_equivalency(self):
+        # Build a table of all version equivalencies, resolved against the version of Kodi
+        # we're running, so a check is a single lookup by lowercase action/condition
+        if self.version_equivalency is not None:
+            return self.version_equivalency
+
+        trees = [self.get_overrides_skin(), self.get_overrides_script()]
+
+        self.version_equivalency = {}
+        for check_type, find_elem, find_attrib in (("shortcuts", "shortcutEquivalent", "action"),
+                                                   ("groupings", "groupEquivalent", "condition")):
+            # Resolve each tree separately - within a tree the first element that applies to
+            # an action decides, and an equivalent in any tree is enough
+            resolved_trees = []
+            for tree in trees:
+                if tree.find("versionEquivalency") is None:
                     continue
 
-                # The actions match, and the version isn't too old, so
-                # now check it's not too new
-                if elem.text == "All":
-                    # This shortcut matches all newer versions
-                    return True
+                resolved = {}
+                resolved_all = None
+                for elem in tree.find("versionEquivalency").findall(find_elem):
+                    try:
+                        if int(elem.attrib.get("version")) > int(KODI_VERSION):
+                            # This version of Kodi is older than the shortcut is intended for
+                            continue
+
+                        # The version isn't too old, so check it's not too new
+                        matched = elem.text == "All" or int(elem.text) >= int(KODI_VERSION)
+                    except (TypeError, ValueError):
+                        log("Invalid <%s /> element in versionEquivalency" % find_elem)
+                        continue
+
+                    if resolved_all is not None:
+                        # An earlier element without an action/condition matches everything
+                        break
+
+                    if elem.attrib.get(find_attrib) is None:
+                        # No action/condition, so this element applies to everything
+                        # not already resolved
+                        resolved_all = matched
+                        continue
+
+                    key = elem.attrib.get(find_attrib).lower()
+                    if key not in resolved:
+                        resolved[key] = matched
+
+                resolved_trees.append((resolved, resolved_all is True))
 
-                if int(elem.text) >= int(KODI_VERSION):
-                    return True
+            equivalents = {}
+            for resolved, _ in resolved_trees:
+                for key in resolved:
+                    equivalents[key] = any(tree_resolved.get(key, tree_resolved_all)
+                                           for tree_resolved, tree_resolved_all in resolved_trees)
 
-                # The version didn't match
-                break
+            self.version_equivalency[check_type] = \
+                (equivalents, any(resolved_all for _, resolved_all in resolved_trees))
 
-        return False
+        return self.version_equivalency
 
     def check_additional_properties(self, group, label_id, default_id, is_user_shortcuts):
         # Return any additional properties, including widgets, backgrounds, icons and thumbnails
@@ -1193,40 +1268,28 @@ class DataFunctions:
 
         return True
 
-    def get_shared_skin_list(self):
+    @staticmethod
+    def get_shared_skin_list():
         # This will return a list of skins the user can import the menu from
+        catalogue = read_catalogue()
+
         skin_names = []
-        skin_files = []
-        for files in xbmcvfs.listdir(DATA_PATH):
-            # Try deleting all shortcuts
-            if files:
-                for file in files:
-                    if file.endswith(".hash") and not file.startswith("%s-" % SKIN_DIR):
-                        can_import, skin_name = self.parse_hash_file(os.path.join(DATA_PATH, file))
-                        if can_import is True:
-                            skin_names.append(skin_name)
-
-                    elif file.endswith(".DATA.xml") and \
-                            not file.startswith("%s-" % SKIN_DIR):
-                        skin_files.append(file)
-
-        # Remove any files which start with one of the skin names
-        remove_skins = []
         remove_files = []
-        for skin_name in skin_names:
-            matched = False
-            for skin_file in skin_files:
-                if skin_file.startswith("%s-" % skin_name):
-                    if matched is False:
-                        matched = True
-                    remove_files.append(skin_file)
-
-            if matched is False:
+        for skin_name, skin in catalogue["skins"].items():
+            if skin["hash"].startswith("%s-" % SKIN_DIR) or skin["fullmenu"] is not True:
+                continue
+
+            skin_files = [x for x in skin["files"] if not x.startswith("%s-" % SKIN_DIR)]
+            if len(skin_files) == 0:
                 # This skin doesn't have a custom menu
-                remove_skins.append(skin_name)
+                continue
 
-        skin_names = [x for x in skin_names if x not in remove_skins]
-        skin_files = [x for x in skin_files if x not in remove_files]
+            skin_names.append(skin.get("name", skin_name))
+            remove_files.extend(skin_files)
+
+        # Any files which don't start with one of the skin names are the shared menu
+        skin_files = [x for x in catalogue["files"]
+                      if not x.startswith("%s-" % SKIN_DIR) and x not in remove_files]
 
         # If there are any files left in skin_files, we have a shared menu
         if len(skin_files) != 0:
@@ -1237,35 +1300,15 @@ class DataFunctions:
     @staticmethod
     def get_files_for_skin(skin_name):
         # This will return a list of all menu files for a particular skin
-        skin_files = []
-        for files in xbmcvfs.listdir(DATA_PATH):
-            # Try deleting all shortcuts
-            if files:
-                for file in files:
-                    if file.endswith(".DATA.xml") and file.startswith("%s-" % skin_name):
-                        skin_files.append(file)
+        catalogue = read_catalogue()
+        if skin_name in catalogue["skins"]:
+            return catalogue["skins"][skin_name]["files"]
 
-        return skin_files
+        return [x for x in catalogue["files"] if x.startswith("%s-" % skin_name)]
 
     @staticmethod
     def parse_hash_file(hash_file):
-        can_import = False
-        skin_name = ""
-
-        hashes = read_hashes(hash_file)
-
-        for _hash in hashes:
-            if _hash[0] == "::FULLMENU::":
-                can_import = True
-                if skin_name:
-                    return True, skin_name
-
-            if _hash[0] == "::SKINDIR::":
-                skin_name = _hash[1]
-                if can_import is True:
-                    return True, skin_name
-
-        return can_import, skin_name
+        return parse_hashes(read_hashes(hash_file))
 
     @staticmethod
     def import_skin_menu(files, skin_name=None):
@@ -1282,6 +1325,9 @@ class DataFunctions:
             # Copy file
             xbmcvfs.copy(old_path, new_path)
 
+        # Record the new files in the catalogue
+        update_catalogue()
+
         # Delete any .properties file
         if xbmcvfs.exists(PROPERTIES_FILE):
             xbmcvfs.delete(PROPERTIES_FILE)
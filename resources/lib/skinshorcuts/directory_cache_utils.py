@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+    Copyright (C) 2013-2021 Skin Shortcuts (script.skinshortcuts)
+    This file is part of script.skinshortcuts
+    SPDX-License-Identifier: GPL-2.0-only
+    See LICENSES/GPL-2.0-only.txt for more information.
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+class DirectoryCache:
+    # Remembers directory listings for ttl seconds, dropping the least recently used
+    # listings once they take up more than max_bytes
+
+    def __init__(self, ttl, max_bytes):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+
+            expires, size, response = self.entries[key]
+            if expires < time.time():
+                del self.entries[key]
+                self.size -= size
+                return None
+
+            self.entries.move_to_end(key)
+            return response
+
+    def set(self, key, response):
+        if self.ttl <= 0:
+            return
+
+        size = len(json.dumps(response))
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+
+            self.entries[key] = (time.time() + self.ttl, size, response)
+            self.size += size
+
+            while self.size > self.max_bytes:
+                self.size -= self.entries.popitem(last=False)[1][1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+    Copyright (C) 2013-2021 Skin Shortcuts (script.skinshortcuts)
+    This file is part of script.skinshortcuts
+    SPDX-License-Identifier: GPL-2.0-only
+    See LICENSES/GPL-2.0-only.txt for more information.
+"""
+
+from . import jsonrpc
+
+# How many entries of a directory explorer lists before showing them (the rest are listed while
+# they're shown), and the properties it asks for - all that's needed to show and guess the content
+# type of each entry, or only what's needed to guess the content type
+EXPLORER_PAGE_SIZE = 200
+EXPLORER_PROPERTIES = ["title", "file", "thumbnail", "episode", "showtitle", "season", "album",
+                       "artist", "imdbnumber", "firstaired", "mpaa", "trailer", "studio", "art"]
+EXPLORER_TYPE_PROPERTIES = ["title", "file", "episode", "showtitle", "season", "album", "artist",
+                            "imdbnumber", "mpaa", "trailer", "studio"]
+
+
+def list_directory(location, state):
+    # Yield the responses listing a directory for explorer, or None if listing fails
+    if location.startswith("plugin://"):
+        # Kodi runs the plugin for the whole directory whatever part of it we ask for,
+        # so list it all at once
+        limits = [(None, None)]
+    else:
+        # List the first page, so it can be shown straight away, then the rest in one go
+        limits = [(0, EXPLORER_PAGE_SIZE), (EXPLORER_PAGE_SIZE, -1)]
+
+    for start, end in limits:
+        json_response = jsonrpc.files_get_directory(location, state["properties"], start, end)
+        if not json_response:
+            yield None
+            return
+
+        yield json_response
+
+        listed = (start or 0) + len(json_response['result']['files'])
+        total = json_response['result'].get('limits', {}).get('total', listed)
+        if listed >= total:
+            return
@@ -20,6 +20,7 @@ import xbmcvfs
 
 from . import datafunctions
 from . import library
+from .catalogue_utils import update_catalogue
 from .common import log
 from .common_utils import ShowDialog
 from .common_utils import disable_logging
@@ -559,7 +560,8 @@ class GUI(xbmcgui.WindowXMLDialog):
 
         # If the skin doesn't have the icon, replace it with DefaultShortcut.png
         set_default = False
-        if (not xbmc.skinHasImage(icon) and set_to_default is True) and not icon_is_var:
+        if (not self.data_func.skin_has_image(icon) and set_to_default is True) and \
+                not icon_is_var:
             if old_icon is None:
                 old_icon = icon
             set_default = True
@@ -831,6 +833,9 @@ class GUI(xbmcgui.WindowXMLDialog):
             # Save widgets, backgrounds and custom properties
             self._save_properties(properties, label_id_changes_dict, copy_default_properties)
 
+            # Record the menu files in the catalogue
+            update_catalogue()
+
             # Note that we've saved stuff
             HOME_WINDOW.setProperty("skinshortcuts-reloadmainmenu", "True")
 
@@ -7,19 +7,71 @@
 """
 
 import json
+import time
 
 import xbmc
 
+from . import rpc_stats_utils
 from .common import log
 
 
 def rpc_request(request):
-    payload = xbmc.executeJSONRPC(json.dumps(request))
+    request_payload = json.dumps(request)
+    # Only Kodi's part of the call is timed
+    started = time.perf_counter()
+    payload = xbmc.executeJSONRPC(request_payload)
+    elapsed = time.perf_counter() - started
     response = json.loads(payload)
-    log('JSONRPC: Requested |%s| received |%s|' % (request, str(response)))
+    rpc_stats_utils.record(request.get("method"), elapsed, request_payload, payload,
+                           int('error' in response))
     return response
 
 
+def rpc_batch(requests):
+    # Send a list of requests in a single call, and return their responses in the same order.
+    # Each request is given its position as its id, which is what the responses are matched on
+    if not requests:
+        return []
+
+    batch = []
+    for request_id, request in enumerate(requests):
+        request = dict(request)
+        request["id"] = request_id
+        batch.append(request)
+
+    request_payload = json.dumps(batch)
+    started = time.perf_counter()
+    payload = xbmc.executeJSONRPC(request_payload)
+    elapsed = time.perf_counter() - started
+    response = json.loads(payload)
+
+    # A batch is counted as a single call, of all the methods in it
+    method = "batch(%s)" % ",".join(sorted(set(request.get("method") for request in batch)))
+    if isinstance(response, list):
+        errors = len([item for item in response if isinstance(item, dict) and 'error' in item])
+    else:
+        errors = len(requests)
+    rpc_stats_utils.record(method, elapsed, request_payload, payload, errors)
+
+    if not isinstance(response, list):
+        # The batch as a whole was rejected, so that's the response to each request
+        return [response] * len(requests)
+
+    responses = [{}] * len(requests)
+    for item in response:
+        request_id = item.get("id") if isinstance(item, dict) else None
+        if isinstance(request_id, int) and 0 <= request_id < len(requests):
+            responses[request_id] = item
+
+    return responses
+
+
+def validate_batch_responses(requests, responses, required_attrib=None):
+    # Returns each response of a batch, or None for those which aren't valid
+    return [response if validate_rpc_response(response, request, required_attrib) else None
+            for request, response in zip(requests, responses)]
+
+
 def validate_rpc_response(response, request=None, required_attrib=None):
     if 'result' in response:
         if not required_attrib:
@@ -45,7 +97,8 @@ def validate_rpc_response(response, request=None, required_attrib=None):
     return False
 
 
-def files_get_directory(directory, properties=None):
+def files_get_directory(directory, properties=None, start=None, end=None):
+    # start and end, when passed, limit the response to that part of the directory
     payload = {
         "jsonrpc": "2.0",
         "id": 0,
@@ -57,6 +110,11 @@ def files_get_directory(directory, properties=None):
     }
     if properties:
         payload["params"]["properties"] = properties
+    if start is not None and end is not None:
+        payload["params"]["limits"] = {
+            "start": start,
+            "end": end
+        }
 
     response = rpc_request(payload)
     if not validate_rpc_response(response, payload, 'files'):
@@ -64,8 +122,8 @@ def files_get_directory(directory, properties=None):
     return response
 
 
-def files_get_sources(media):
-    payload = {
+def _files_get_sources_payload(media):
+    return {
         "jsonrpc": "2.0",
         "id": 0,
         "method": "Files.GetSources",
@@ -74,13 +132,22 @@ def files_get_sources(media):
         }
     }
 
+
+def files_get_sources(media):
+    payload = _files_get_sources_payload(media)
+
     response = rpc_request(payload)
     if not validate_rpc_response(response, payload, 'sources'):
         return None
     return response
 
 
-def addons_get_addons(content, properties=None):
+def files_get_sources_batch(media_types):
+    payloads = [_files_get_sources_payload(media) for media in media_types]
+    return validate_batch_responses(payloads, rpc_batch(payloads), 'sources')
+
+
+def _addons_get_addons_payload(content, properties=None):
     payload = {
         "jsonrpc": "2.0",
         "id": 0,
@@ -92,13 +159,24 @@ def addons_get_addons(content, properties=None):
     if properties:
         payload["params"]["properties"] = properties
 
+    return payload
+
+
+def addons_get_addons(content, properties=None):
+    payload = _addons_get_addons_payload(content, properties)
+
     response = rpc_request(payload)
     if not validate_rpc_response(response, payload, 'addons'):
         return None
     return response
 
 
-def pvr_get_channels(group_id, properties=None):
+def addons_get_addons_batch(contents, properties=None):
+    payloads = [_addons_get_addons_payload(content, properties) for content in contents]
+    return validate_batch_responses(payloads, rpc_batch(payloads), 'addons')
+
+
+def _pvr_get_channels_payload(group_id, properties=None):
     payload = {
         "jsonrpc": "2.0",
         "id": 0,
@@ -110,12 +188,23 @@ def pvr_get_channels(group_id, properties=None):
     if properties:
         payload["params"]["properties"] = properties
 
+    return payload
+
+
+def pvr_get_channels(group_id, properties=None):
+    payload = _pvr_get_channels_payload(group_id, properties)
+
     response = rpc_request(payload)
     if not validate_rpc_response(response, payload, 'channels'):
         return None
     return response
 
 
+def pvr_get_channels_batch(group_ids, properties=None):
+    payloads = [_pvr_get_channels_payload(group_id, properties) for group_id in group_ids]
+    return validate_batch_responses(payloads, rpc_batch(payloads), 'channels')
+
+
 def player_open(channel_id):
     payload = {
         "jsonrpc": "2.0",
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+    Copyright (C) 2013-2021 Skin Shortcuts (script.skinshortcuts)
+    This file is part of script.skinshortcuts
+    SPDX-License-Identifier: GPL-2.0-only
+    See LICENSES/GPL-2.0-only.txt for more information.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import xbmcvfs
+
+from . import jsonrpc
+from .common import log
+
+
+def kodiwalk(path, string_force=False, max_depth=None, max_entries=None, workers=1):
+    # Yield the files within a path (and its sub-directories, up to max_depth levels down) as
+    # they're found, stopping after max_entries. With more than one worker, the sub-directories
+    # of each directory are listed at the same time
+    executor = None
+    if workers > 1:
+        executor = ThreadPoolExecutor(max_workers=workers)
+
+    count = 0
+    try:
+        json_response = jsonrpc.files_get_directory(str(path))
+        for file in _kodiwalk(json_response, string_force, max_depth, 0, executor):
+            if max_entries is not None and count >= max_entries:
+                log("Stopped listing %s after %s files" % (path, str(count)))
+                return
+
+            count += 1
+            yield file
+
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+def _kodiwalk(json_response, string_force, max_depth, depth, executor):
+    if not json_response:
+        return
+
+    items = [item for item in json_response['result']['files']
+             if 'file' in item and 'filetype' in item and 'label' in item]
+
+    # Work out the path of each sub-directory we'll be listing
+    directories = {}
+    if max_depth is None or depth < max_depth:
+        for index, item in enumerate(items):
+            if item['filetype'] == 'directory' and \
+                    not item['file'].endswith(('.xsp', '.m3u', '.xml/', '.xml')):
+                if string_force and item['file'].startswith(string_force):
+                    directories[index] = xbmcvfs.translatePath(item['file'])
+                else:
+                    directories[index] = item['file']
+
+    futures = {}
+    if executor is not None:
+        for index, directory in directories.items():
+            futures[index] = executor.submit(jsonrpc.files_get_directory, str(directory))
+
+    try:
+        for index, item in enumerate(items):
+            if index in directories:
+                if index in futures:
+                    sub_response = futures[index].result()
+                else:
+                    sub_response = jsonrpc.files_get_directory(str(directories[index]))
+
+                yield from _kodiwalk(sub_response, string_force, max_depth, depth + 1, executor)
+
+            elif item['filetype'] == 'directory' and \
+                    not item['file'].endswith(('.xsp', '.m3u', '.xml/', '.xml')):
+                # Deeper than we've been asked to go
+                continue
+
+            elif string_force and item['file'].startswith(string_force):
+                yield {
+                    'path': xbmcvfs.translatePath(item['file']),
+                    'label': item['label']
+                }
+
+            else:
+                yield {
+                    'path': item['file'],
+                    'label': item['label']
+                }
+
+    finally:
+        # If we've stopped early, there's no need to list anything that hasn't started
+        for future in futures.values():
+            future.cancel()
@@ -8,7 +8,12 @@
 
 import ast
 import os
+import threading
 import xml.etree.ElementTree as ETree
+from concurrent.futures import CancelledError
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from traceback import print_exc
 from urllib.parse import unquote
 from urllib.request import url2pathname
@@ -18,12 +23,18 @@ import xbmc
 import xbmcgui
 import xbmcvfs
 
+from . import addon_utils
 from . import datafunctions
+from . import directory_cache_utils
+from . import explorer_utils
 from . import jsonrpc
+from . import library_cache_utils
+from . import listitem_utils
 from . import nodefunctions
+from . import playlist_utils
 from .common import log
-from .common import read_file
 from .common_utils import ShowDialog
+from .constants import ADDON
 from .constants import ADDON_ID
 from .constants import CWD
 from .constants import DATA_PATH
@@ -31,37 +42,20 @@ from .constants import KODI_PATH
 from .constants import KODI_VERSION
 from .constants import LANGUAGE
 from .constants import PROFILE_PATH
+from .constants import SKIN_DIR
+from .kodiwalk_utils import kodiwalk
 
+# How many library sections are loaded at once - most of the time spent loading them is
+# waiting on JSON-RPC and the filesystem
+LIBRARY_WORKERS = 4
 
-def kodiwalk(path, string_force=False):
-    files = []
+# How far kodiwalk goes into the playlist directories, and how many playlists it lists
+PLAYLIST_WALK_DEPTH = 10
+PLAYLIST_WALK_ENTRIES = 5000
 
-    json_response = jsonrpc.files_get_directory(str(path))
-    if not json_response:
-        return []
-
-    for item in json_response['result']['files']:
-        if 'file' in item and 'filetype' in item and 'label' in item:
-            if item['filetype'] == 'directory' and \
-                    not item['file'].endswith(('.xsp', '.m3u', '.xml/', '.xml')):
-                if string_force and item['file'].startswith(string_force):
-                    files = files + kodiwalk(xbmcvfs.translatePath(item['file']), string_force)
-                else:
-                    files = files + kodiwalk(item['file'], string_force)
-
-            else:
-                if string_force and item['file'].startswith(string_force):
-                    files.append({
-                        'path': xbmcvfs.translatePath(item['file']),
-                        'label': item['label']
-                    })
-                else:
-                    files.append({
-                        'path': item['file'],
-                        'label': item['label']
-                    })
-
-    return files
+# How much of the directories explorer has listed are kept for going back to them (the time
+# they're kept for is the explorer_cache_ttl setting)
+EXPLORER_CACHE_BYTES = 8 * 1024 * 1024
 
 
 # noinspection PyListCreation
@@ -142,19 +136,113 @@ class LibraryFunctions:
         self.loaded_favourites = False
         self.fav_list = None
 
+        # The library sections saved by the last session, and the token of the add-ons
+        # (which is only asked for once, as it's a JSON request)
+        self.library_cache = {}
+        self.addons_token = None
+
+        # The future of each library section which has been scheduled to load, or is loading
+        self.library_futures = {}
+        self.library_lock = threading.Lock()
+
+        # Label IDs are shared by every listitem we create, so sections loading at the same
+        # time take it in turns to get theirs
+        self.label_id_lock = threading.Lock()
+
+        # The visibility conditions checked by the library section each thread is loading,
+        # and their results - the cached section is only valid while they're unchanged
+        self.checked_conditions = threading.local()
+
+        # The directories explorer has listed this session
+        self.directory_cache = directory_cache_utils.DirectoryCache(
+            ADDON.getSettingInt("explorer_cache_ttl"), EXPLORER_CACHE_BYTES
+        )
+
     def load_library(self, library):
         # Common entry point for loading available shortcuts
 
-        # Handle whether the shortcuts are already loaded/loading
+        # Handle whether the shortcuts are already loaded
         if self.loaded[library][0] is True:
             return True
 
-        if self.loaded[library][0] == "Loading":
+        with self.library_lock:
+            future = self.library_futures.get(library)
+            load_here = future is None or future.cancel()
+            if load_here:
+                # It isn't loading (or is still waiting for the pool), so we'll load it now
+                future = Future()
+                future.set_running_or_notify_cancel()
+                self.library_futures[library] = future
+
+        if load_here:
+            future.set_result(self.refresh_library(library))
+        else:
             # The list is currently being populated, wait and then return it
-            for _ in range(0, 50):
-                if xbmc.Monitor().waitForAbort(0.1) or self.loaded[library][0] is True:
-                    return True
+            future.result()
 
+        return True
+
+    def schedule_library(self, executor, library):
+        # Queue a library section to be loaded by the pool, unless it's already been
+        with self.library_lock:
+            if library not in self.library_futures:
+                self.library_futures[library] = executor.submit(self.refresh_library, library)
+
+    def wait_for_library(self, library):
+        # Wait for a scheduled library section to load, and return whether it was cached
+        while True:
+            with self.library_lock:
+                future = self.library_futures[library]
+
+            try:
+                return future.result()
+            except CancelledError:
+                # It's been taken from the pool to be loaded straight away
+                continue
+
+    def refresh_library(self, library):
+        # Load a library section, unless nothing it depends on has changed since it was
+        # cached, and return whether it's been (re)cached
+        token = self.get_cache_token(library)
+        cache = self.library_cache.get(library, {})
+        if token is not None and cache.get("token") == token and \
+                library_cache_utils.conditions_unchanged(cache.get("conditions")):
+            self.loaded[library][0] = True
+            return False
+
+        if self.loaded[library][0] is not True:
+            # Clear anything the section appends to, before it reloads
+            if library == "playlists":
+                self.widget_playlists_list = []
+            elif library == "widgets":
+                self.dictionary_groupings["widgets-classic"] = []
+
+        previous_conditions = getattr(self.checked_conditions, "conditions", None)
+        self.checked_conditions.conditions = {}
+        try:
+            self._load_library(library)
+            conditions = self.checked_conditions.conditions
+        finally:
+            self.checked_conditions.conditions = previous_conditions
+
+        if token is None:
+            return False
+
+        self.library_cache[library] = self.save_library(library, token, conditions)
+        return True
+
+    def check_condition(self, condition):
+        # Check a visibility condition, noting its result if it's for a library section
+        # we're loading
+        result = xbmc.getCondVisibility(condition)
+
+        conditions = getattr(self.checked_conditions, "conditions", None)
+        if conditions is not None:
+            conditions[condition] = bool(result)
+
+        return result
+
+    def _load_library(self, library):
         # We're going to populate the list
         self.loaded[library][0] = "Loading"
 
@@ -174,14 +262,37 @@ class LibraryFunctions:
 
         # Mark library type as loaded
         self.loaded[library][0] = True
-        return True
 
     def load_all_library(self):
         # Load all library data, for use with threading
-        for library in ("common", "more", "videolibrary", "musiclibrary", "pvrlibrary",
-                        "radiolibrary", "librarysources", "playlists", "addons",
-                        "favourites", "settings", "widgets"):
-            self.load_library(library)
+        libraries = ("common", "more", "videolibrary", "musiclibrary", "pvrlibrary",
+                     "radiolibrary", "librarysources", "playlists", "addons",
+                     "favourites", "settings", "widgets")
+
+        # First fill everything we can from what the last session loaded, so that it's
+        # available straight away
+        library_cache = library_cache_utils.read_library_cache()
+        library_cache.update(self.library_cache)
+        self.library_cache = library_cache
+        for library in libraries:
+            if library in self.library_cache and self.loaded[library][0] is False:
+                self.restore_library(library)
+
+        # Then, unless nothing it depends on has changed, (re)load the sections a few at a
+        # time. Any section the user asks for before its turn will be loaded straight away
+        executor = ThreadPoolExecutor(max_workers=LIBRARY_WORKERS)
+        for library in libraries:
+            self.schedule_library(executor, library)
+
+        changed = False
+        for library in libraries:
+            if self.wait_for_library(library):
+                changed = True
+
+        executor.shutdown(wait=False)
+
+        if changed:
+            library_cache_utils.write_library_cache(self.library_cache)
 
         # Do a JSON query for upnp sources
         # (so that they'll show first time the user asks to see them)
@@ -190,6 +301,75 @@ class LibraryFunctions:
                 jsonrpc.files_get_directory('upnp://', ["title", "file", "thumbnail"]) \
                 not in (False, None)
 
+    def get_cache_token(self, library):
+        # Returns a token which changes when anything a library section is built from changes,
+        # or None if the section isn't cached
+        if library not in library_cache_utils.CACHED_GROUPINGS:
+            return None
+
+        # Every section depends on the skin, language and overrides
+        tokens = [SKIN_DIR, KODI_VERSION, xbmc.getLanguage(),
+                  library_cache_utils.paths_token(self.data_func.skin_overrides_file,
+                                                  self.data_func.default_overrides_file,
+                                                  os.path.join(DATA_PATH, "overrides.xml"))]
+
+        paths = library_cache_utils.section_paths(library)
+        if paths:
+            tokens.append(library_cache_utils.paths_token(*paths))
+
+        elif library == "addons":
+            if self.addons_token is None:
+                self.addons_token = library_cache_utils.addons_token()
+            if self.addons_token is None:
+                return None
+
+            tokens.append(self.addons_token)
+
+        return tokens
+
+    def save_library(self, library, token, conditions):
+        # Returns the plain data of the groupings of a library section, and the results of the
+        # visibility conditions it checked, to be cached
+        groupings = {}
+        for group in library_cache_utils.CACHED_GROUPINGS[library]:
+            items = self.dictionary_groupings[group]
+            if items is not None:
+                groupings[group] = [library_cache_utils.listitem_to_dict(item) for item in items]
+
+        cache = {
+            "token": token,
+            "conditions": conditions,
+            "groupings": groupings
+        }
+
+        if library == "playlists":
+            cache["widget_playlists"] = self.widget_playlists_list
+        elif library == "widgets":
+            cache["widgets_classic"] = self.dictionary_groupings["widgets-classic"]
+
+        return cache
+
+    def restore_library(self, library):
+        # Fill the groupings of a library section from the cache
+        try:
+            cache = self.library_cache[library]
+            describe = partial(listitem_utils.lazy_listitem_from_dict, self)
+            for group, items in cache["groupings"].items():
+                self.dictionary_groupings[group] = \
+                    [library_cache_utils.listitem_from_dict(item, describe) for item in items]
+
+            if library == "playlists":
+                self.widget_playlists_list = cache.get("widget_playlists", [])
+            elif library == "widgets":
+                self.dictionary_groupings["widgets-classic"] = cache.get("widgets_classic", [])
+            elif library == "favourites":
+                self.loaded_favourites = True
+
+        except:
+            log(print_exc())
+            log("Failed to restore %s from the cache" % (self.loaded[library][1]))
+            del self.library_cache[library]
+
     # ==============================================
     # === BUILD/DISPLAY AVAILABLE SHORTCUT NODES ===
     # ==============================================
@@ -416,18 +596,20 @@ class LibraryFunctions:
 
     def check_for_folder(self, items):
         # This function will check for any folders in the listings that are being returned
-        # and, if found, move their sub-items into a property
+        # and, if found, move their sub-items into a property. As they're going to be shown,
+        # this is also where the listitems of the items are created
         return_items = []
         for item in items:
             if isinstance(item, list):
                 self.folders_count += 1
-                self.folders[str(self.folders_count)] = item[1]
-                new_item = item[0]
+                self.folders[str(self.folders_count)] = [listitem_utils.get_listitem(child)
+                                                         for child in item[1]]
+                new_item = listitem_utils.get_listitem(item[0])
                 new_item.setProperty("folder", str(self.folders_count))
                 return_items.append(new_item)
 
             else:
-                return_items.append(item)
+                return_items.append(listitem_utils.get_listitem(item))
 
         return return_items
 
@@ -547,7 +729,7 @@ class LibraryFunctions:
                         }])
 
                         if "condition" in elem.attrib:
-                            if xbmc.getCondVisibility(elem.attrib.get("condition")):
+                            if self.check_condition(elem.attrib.get("condition")):
                                 content.insert(0, listitem)
                         else:
                             content.insert(0, listitem)
@@ -584,7 +766,7 @@ class LibraryFunctions:
                     }])
 
                     if "condition" in elem.attrib:
-                        if xbmc.getCondVisibility(elem.attrib.get("condition")):
+                        if self.check_condition(elem.attrib.get("condition")):
                             content.append(listitem)
 
                     else:
@@ -596,6 +778,11 @@ class LibraryFunctions:
     # === BUILD AVAILABLE SHORTCUT ===
     # ================================
 
+    def describe(self, item, allow_override_label=True):
+        # Returns an available shortcut whose listitem will be created (by create) when
+        # it's shown - for the larger groupings, where most items never are
+        return listitem_utils.LazyListItem(self, item, allow_override_label)
+
     def create(self, item, allow_override_label=True):
         # Retrieve label
         local_label = self.data_func.local(item[1])[0]
@@ -642,13 +829,14 @@ class LibraryFunctions:
             localized_only = True
 
         # Get the items labelID
-        self.data_func.clear_label_id()
-        label_id = self.data_func.get_label_id(
-            self.data_func.create_nice_name(self.data_func.local(local_label)[0],
-                                            localized_only=localized_only),
-            item[0],
-            localized_only=localized_only
-        )
+        with self.label_id_lock:
+            self.data_func.clear_label_id()
+            label_id = self.data_func.get_label_id(
+                self.data_func.create_nice_name(self.data_func.local(local_label)[0],
+                                                localized_only=localized_only),
+                item[0],
+                localized_only=localized_only
+            )
 
         # Retrieve icon and thumbnail
         if item[3]:
@@ -695,7 +883,8 @@ class LibraryFunctions:
             icon_is_var = True
 
         # If the skin doesn't have the icon, replace it with DefaultShortcut.png
-        if (not display_icon or not xbmc.skinHasImage(display_icon)) and not icon_is_var:
+        if (not display_icon or not self.data_func.skin_has_image(display_icon)) and \
+                not icon_is_var:
             if not used_default_thumb_as_icon:
                 display_icon = "DefaultShortcut.png"
 
@@ -732,28 +921,18 @@ class LibraryFunctions:
 
         oldicon = None
         newicon = item.getProperty("icon")
-        for elem in tree.findall("icon"):
-            if oldicon is None:
-                if ("labelID" in elem.attrib and
-                    elem.attrib.get("labelID") == item.getProperty("tempLabelID")) or \
-                        ("image" in elem.attrib and elem.attrib.get("image") ==
-                         item.getProperty("icon")):
-
-                    # LabelID matched
-                    if "grouping" in elem.attrib:
-                        if elem.attrib.get("grouping") == content:
-                            # Group also matches - change icon
-                            oldicon = item.getProperty("icon")
-                            newicon = elem.text
-
-                    elif "group" not in elem.attrib:
-                        # No group - change icon
-                        oldicon = item.getProperty("icon")
-                        newicon = elem.text
+
+        # LabelID (or image) matched, and grouping also matches or there's no group
+        override = self.data_func.find_icon_override(tree, ("grouping", "group", content),
+                                                     item.getProperty("tempLabelID"),
+                                                     item.getProperty("icon"))
+        if override is not None:
+            oldicon = item.getProperty("icon")
+            newicon = override[1]
 
         # If the icon doesn't exist, set icon to default
         set_default = False
-        if not xbmc.skinHasImage(newicon) and set_to_default is True:
+        if not self.data_func.skin_has_image(newicon) and set_to_default is True:
             oldicon = item.getProperty("icon")
             set_default = True
 
@@ -992,14 +1171,14 @@ class LibraryFunctions:
             }]),
         ]
 
-        if (xbmc.getCondVisibility("System.Platform.Windows") or
-            xbmc.getCondVisibility("System.Platform.Linux")) and \
-                not xbmc.getCondVisibility("System.Platform.Linux.RaspberryPi"):
+        if (self.check_condition("System.Platform.Windows") or
+            self.check_condition("System.Platform.Linux")) and \
+                not self.check_condition("System.Platform.Linux.RaspberryPi"):
             listitems.append(self.create(["RestartApp", "13313", "32054", {
                 "icon": "RestartApp.png"
             }]))
 
-        if xbmc.getCondVisibility("System.HasLoginScreen"):
+        if self.check_condition("System.HasLoginScreen"):
             listitems.append(self.create(["System.LogOff", "20126", "32054", {
                 "icon": "LogOff.png"
             }]))
@@ -1069,15 +1248,20 @@ class LibraryFunctions:
         ]
         self.add_to_dictionary("pvr", listitems)
 
+        # Get the tv and radio channels in one request
+        tv_response, radio_response = \
+            jsonrpc.pvr_get_channels_batch(["alltv", "allradio"],
+                                           ["thumbnail", "channeltype", "hidden", "locked",
+                                            "channel", "lastplayed"])
+
         # Add tv channels
         listitems = []
-        json_response = jsonrpc.pvr_get_channels("alltv", ["thumbnail", "channeltype", "hidden",
-                                                           "locked", "channel", "lastplayed"])
+        json_response = tv_response
 
         # Add all directories returned by the json query
         if json_response:
             for item in json_response['result']['channels']:
-                listitems.append(self.create(
+                listitems.append(self.describe(
                     ["pvr-channel://%s" % str(item['channelid']), item['label'], "::SCRIPT::32076",
                      {
                          "icon": "DefaultTVShows.png",
@@ -1089,13 +1273,12 @@ class LibraryFunctions:
 
         # Add radio channels
         listitems = []
-        json_response = jsonrpc.pvr_get_channels("allradio", ["thumbnail", "channeltype", "hidden",
-                                                              "locked", "channel", "lastplayed"])
+        json_response = radio_response
 
         # Add all directories returned by the json query
         if json_response:
             for item in json_response['result']['channels']:
-                listitems.append(self.create(
+                listitems.append(self.describe(
                     ["pvr-channel://%s" % str(item['channelid']), item['label'], "::SCRIPT::32077",
                      {
                          "icon": "DefaultTVShows.png",
@@ -1164,14 +1347,18 @@ class LibraryFunctions:
                 not in (False, None)
 
     def librarysources(self):
+        # Get the video, audio and picture sources in one request
+        video_response, music_response, pictures_response = \
+            jsonrpc.files_get_sources_batch(["video", "music", "pictures"])
+
         # Add video sources
         listitems = []
-        json_response = jsonrpc.files_get_sources("video")
+        json_response = video_response
 
         # Add all directories returned by the json query
         if json_response:
             for item in json_response['result']['sources']:
-                listitems.append(self.create(
+                listitems.append(self.describe(
                     ["||SOURCE||%s" % item['file'], item['label'], "32069", {
                         "icon": "DefaultFolder.png"
                     }]
@@ -1183,12 +1370,12 @@ class LibraryFunctions:
 
         # Add audio sources
         listitems = []
-        json_response = jsonrpc.files_get_sources("music")
+        json_response = music_response
 
         # Add all directories returned by the json query
         if json_response:
             for item in json_response['result']['sources']:
-                listitems.append(self.create(
+                listitems.append(self.describe(
                     ["||SOURCE||%s" % item['file'], item['label'], "32073", {
                         "icon": "DefaultFolder.png"
                     }]
@@ -1200,12 +1387,12 @@ class LibraryFunctions:
 
         # Add picture sources
         listitems = []
-        json_response = jsonrpc.files_get_sources("pictures")
+        json_response = pictures_response
 
         # Add all directories returned by the json query
         if json_response:
             for item in json_response['result']['sources']:
-                listitems.append(self.create(
+                listitems.append(self.describe(
                     ["||SOURCE||%s" % item['file'], item['label'], "32089", {
                         "icon": "DefaultFolder.png"
                     }]
@@ -1225,12 +1412,17 @@ class LibraryFunctions:
             ["special://skin/extras/", '32059', None]
         ]
 
+        # The type and name of the smart playlists we've already read
+        playlist_index = playlist_utils.read_playlist_index()
+        playlist_updates = {}
+
         for path in paths:
             count = 0
             if not xbmcvfs.exists(path[0]):
                 continue
 
-            for file in kodiwalk(path[0]):
+            for file in kodiwalk(path[0], max_depth=PLAYLIST_WALK_DEPTH,
+                                 max_entries=PLAYLIST_WALK_ENTRIES, workers=LIBRARY_WORKERS):
                 try:
                     playlist = file['path']
                     label = file['label']
@@ -1238,71 +1430,62 @@ class LibraryFunctions:
                     media_library = path[2]
 
                     if playlist.endswith('.xsp'):
-                        contents_data = read_file(playlistfile)
-                        xmldata = ETree.fromstring(contents_data)
-                        media_type = "unknown"
-                        try:
-                            iterator = xmldata.iter()
-
-                        except:
-                            # noinspection PyDeprecation
-                            iterator = xmldata.getiterator()
+                        media_type, has_name, name = \
+                            playlist_utils.get_playlist_metadata(playlistfile, playlist_index,
+                                                                 playlist_updates)
 
                         media_content = ''
-                        for line in iterator:
-
-                            if line.tag == "smartplaylist":
-                                media_type = line.attrib['type']
-                                if media_type in ('movies', 'tvshows', 'seasons', 'episodes',
-                                                  'musicvideos', 'sets'):
-                                    media_library = "Videos"
-                                    media_content = "video"
-
-                                elif media_type in ('albums', 'artists', 'songs'):
-                                    media_library = "Music"
-                                    media_content = "music"
-
-                            if line.tag == "name" and media_library is not None:
-                                name = line.text
-                                if not name:
-                                    name = label
-
-                                # Create a list item
-                                listitem = self.create(
-                                    ["::PLAYLIST>%s::" % media_library, name, path[1], {
-                                        "icon": "DefaultPlaylist.png"
-                                    }]
-                                )
-                                listitem.setProperty("action-play", "PlayMedia(%s)" % playlist)
-                                listitem.setProperty("action-show",
-                                                     "ActivateWindow(%s,%s,return)" %
-                                                     (media_library, playlist))
-                                listitem.setProperty("action-party",
-                                                     "PlayerControl(PartyMode(%s))" % playlist)
-
-                                # Add widget information
-                                listitem.setProperty("widget", "Playlist")
-                                listitem.setProperty("widgetType", media_type)
-                                listitem.setProperty("widgetTarget", media_content)
-                                listitem.setProperty("widgetName", name)
-                                listitem.setProperty("widgetPath", playlist)
-
-                                if media_library == "Videos":
-                                    videolist.append(listitem)
-                                else:
-                                    audiolist.append(listitem)
-
-                                # Save it for the widgets list
-                                self.widget_playlists_list.append(
-                                    [playlist, "(%s) %s" % (LANGUAGE(int(path[1])), name), name]
-                                )
-
-                                count += 1
-                                break
+                        if media_type in ('movies', 'tvshows', 'seasons', 'episodes',
+                                          'musicvideos', 'sets'):
+                            media_library = "Videos"
+                            media_content = "video"
+
+                        elif media_type in ('albums', 'artists', 'songs'):
+                            media_library = "Music"
+                            media_content = "music"
+
+                        elif media_type is None:
+                            media_type = "unknown"
+
+                        if has_name and media_library is not None:
+                            if not name:
+                                name = label
+
+                            # Create a list item
+                            listitem = self.describe(
+                                ["::PLAYLIST>%s::" % media_library, name, path[1], {
+                                    "icon": "DefaultPlaylist.png"
+                                }]
+                            )
+                            listitem.setProperty("action-play", "PlayMedia(%s)" % playlist)
+                            listitem.setProperty("action-show",
+                                                 "ActivateWindow(%s,%s,return)" %
+                                                 (media_library, playlist))
+                            listitem.setProperty("action-party",
+                                                 "PlayerControl(PartyMode(%s))" % playlist)
+
+                            # Add widget information
+                            listitem.setProperty("widget", "Playlist")
+                            listitem.setProperty("widgetType", media_type)
+                            listitem.setProperty("widgetTarget", media_content)
+                            listitem.setProperty("widgetName", name)
+                            listitem.setProperty("widgetPath", playlist)
+
+                            if media_library == "Videos":
+                                videolist.append(listitem)
+                            else:
+                                audiolist.append(listitem)
+
+                            # Save it for the widgets list
+                            self.widget_playlists_list.append(
+                                [playlist, "(%s) %s" % (LANGUAGE(int(path[1])), name), name]
+                            )
+
+                            count += 1
 
                     elif playlist.endswith('.m3u') and path[2] is not None:
                         name = label
-                        listitem = self.create(["::PLAYLIST>%s::" % (path[2]), name, path[1], {
+                        listitem = self.describe(["::PLAYLIST>%s::" % (path[2]), name, path[1], {
                             "icon": "DefaultPlaylist.png"
                         }])
                         listitem.setProperty("action-play", "PlayMedia(%s)" % playlist)
@@ -1333,6 +1516,9 @@ class LibraryFunctions:
 
             log("[%s] %s playlists found" % (path[0], str(count)))
 
+        if playlist_updates:
+            playlist_utils.write_playlist_index(playlist_updates)
+
         self.add_to_dictionary("playlist-video", videolist)
         self.add_to_dictionary("playlist-audio", audiolist)
 
@@ -1345,28 +1531,26 @@ class LibraryFunctions:
             log('Loading script generated playlists...')
             path = "special://profile/addon_data/%s/" % ADDON_ID
             count = 0
-            for file in kodiwalk(path):
+            playlist_index = playlist_utils.read_playlist_index()
+            playlist_updates = {}
+            for file in kodiwalk(path, max_depth=PLAYLIST_WALK_DEPTH,
+                                 max_entries=PLAYLIST_WALK_ENTRIES, workers=LIBRARY_WORKERS):
                 playlist = file['path']
                 playlistfile = xbmcvfs.translatePath(playlist)
 
                 if playlist.endswith('-randomversion.xsp'):
-                    contents_data = read_file(playlistfile)
-                    xmldata = ETree.fromstring(contents_data)
-                    try:
-                        iterator = xmldata.iter()
-                    except:
-                        # noinspection PyDeprecation
-                        iterator = xmldata.getiterator()
-
-                    for line in iterator:
-                        if line.tag == "name":
-                            name = line.text
-                            # Save it for the widgets list
-                            # TO-DO - Localize display name
-                            return_playlists.append([playlist, "(Source) %s" % name, name])
+                    _, has_name, name = \
+                        playlist_utils.get_playlist_metadata(playlistfile, playlist_index,
+                                                             playlist_updates)
+                    if has_name:
+                        # Save it for the widgets list
+                        # TO-DO - Localize display name
+                        return_playlists.append([playlist, "(Source) %s" % name, name])
 
-                            count += 1
-                            break
+                        count += 1
+
+            if playlist_updates:
+                playlist_utils.write_playlist_index(playlist_updates)
 
             log("[%s] %s playlists found" % (path[0], str(count)))
 
@@ -1404,7 +1588,7 @@ class LibraryFunctions:
             except:
                 thumb = None
 
-            listitems.append(self.create([path, name, "32006", {
+            listitems.append(self.describe([path, name, "32006", {
                 "icon": "DefaultFolder.png",
                 "thumb": thumb
             }]))
@@ -1430,7 +1614,17 @@ class LibraryFunctions:
             ("image", image_items)
         ]
 
-        for contenttype, listitems in contenttypes:
+        # Get the add-ons of every content type in one request
+        json_responses = jsonrpc.addons_get_addons_batch([contenttype for contenttype, _ in
+                                                          contenttypes],
+                                                         ["name", "path", "thumbnail", "enabled",
+                                                          "version"])
+
+        # What we know about the addon.xml of each add-on, from the last time they were loaded
+        addon_index = addon_utils.read_addon_index()
+        addon_seen = {}
+
+        for (contenttype, listitems), json_response in zip(contenttypes, json_responses):
             # listitems = {}
             shortcut_type = ""
             if contenttype == "executable":
@@ -1452,9 +1646,6 @@ class LibraryFunctions:
             if not shortcut_type:
                 continue
 
-            json_response = jsonrpc.addons_get_addons(contenttype,
-                                                      ["name", "path", "thumbnail", "enabled"])
-
             if json_response:
                 for item in json_response['result']['addons']:
                     if item['enabled'] is True:
@@ -1464,7 +1655,7 @@ class LibraryFunctions:
                         else:
                             thumb = None
 
-                        listitem = self.create([path, item['name'], shortcut_type, {
+                        listitem = self.describe([path, item['name'], shortcut_type, {
                             "icon": "DefaultAddon.png",
                             "thumb": "thumb"
                         }])
@@ -1476,7 +1667,7 @@ class LibraryFunctions:
 
                             listitem.setProperty("path", path)
                             listitem.setProperty("action", action)
-                            listitem.setLabel("%s  >" % listitem.getLabel())
+                            listitem.add_label_suffix("  >")
 
                             # If its executable, save it to our program plugin widget list
                             if contenttype == "executable":
@@ -1484,7 +1675,10 @@ class LibraryFunctions:
 
                         elif contenttype == "executable":
                             # Check if it's a program that can be run as an exectuble
-                            provides = self._has_plugin_entry_point(item["path"])
+                            provides = addon_utils.get_plugin_provides(item["addonid"],
+                                                                       item.get("version"),
+                                                                       item["path"], addon_index,
+                                                                       addon_seen)
                             for content in provides:
                                 # For each content that it provides, add it
                                 # to the add-ons for that type
@@ -1497,7 +1691,7 @@ class LibraryFunctions:
 
                                 if content in content_data:
                                     # Add it as a plugin in the relevant category
-                                    other_item = self.create(
+                                    other_item = self.describe(
                                         [path, "%s  >" % item['name'], content_data[content][0], {
                                             "icon": "DefaultAddon.png",
                                             "thumb": thumb
@@ -1535,25 +1729,9 @@ class LibraryFunctions:
                 self.add_to_dictionary("addon-image", self._sort_dictionary(listitems))
                 log("%s image add-ons found" % str(len(listitems)))
 
-    @staticmethod
-    def _has_plugin_entry_point(path):
-        # Check if an addon has a plugin entry point by parsing its addon.xml file
-        try:
-            tree = ETree.parse(os.path.join(path, "addon.xml")).getroot()
-            for extension in tree.findall("extension"):
-                if "point" in extension.attrib and \
-                        extension.attrib.get("point") == "xbmc.python.pluginsource":
-                    # Find out what content type it provides
-                    provides = extension.find("provides")
-                    if provides is None:
-                        return []
-
-                    return provides.text.split(" ")
-
-        except:
-            log(print_exc())
-
-        return []
+        # Save what we know about the addon.xml of the add-ons that are still installed
+        if addon_seen != addon_index:
+            addon_utils.write_addon_index(addon_seen)
 
     @staticmethod
     def _detect_plugin_content(item):
@@ -1630,7 +1808,7 @@ class LibraryFunctions:
                 widget_type = elem.attrib.get("type")
 
             if "condition" in elem.attrib:
-                if not xbmc.getCondVisibility(elem.attrib.get("condition")):
+                if not self.check_condition(elem.attrib.get("condition")):
                     continue
 
             if "path" in elem.attrib:
@@ -1692,10 +1870,6 @@ class LibraryFunctions:
     # =============================
 
     def explorer(self, history, location, label, thumbnail, item_type, is_widget=False):
-        is_library = False
-        widget_type = None
-        addon_type = None
-
         dialog_label = label[0].replace("  >", "")
         if len(label) != 1:
             dialog_label = "%s - %s" % (label[0].replace("  >", ""), label[-1].replace("  >", ""))
@@ -1728,145 +1902,60 @@ class LibraryFunctions:
 
         log("Getting %s - %s" % (dialog_label, location))
 
-        # Show a waiting dialog, then get the listings for the directory
+        # What we learn about the directory as we list it
+        state = {
+            "is_library": False,
+            "widget_type": None,
+            "addon_type": None,
+            "properties": explorer_utils.EXPLORER_PROPERTIES,
+            "build": True,
+            "complete": False
+        }
+        pages = self._explorer_pages(location, label, item_type, tree, state)
+
+        # Show a waiting dialog, then get the first page of listings for the directory
         dialog = xbmcgui.DialogProgress()
         dialog.create(dialog_label, LANGUAGE(32063))
 
-        # we retrieve a whole bunch of properties, needed to guess the content type properly
-        json_response = jsonrpc.files_get_directory(location, ["title", "file", "thumbnail",
-                                                               "episode", "showtitle", "season",
-                                                               "album", "artist", "imdbnumber",
-                                                               "firstaired", "mpaa", "trailer",
-                                                               "studio", "art"])
-
-        # Add all directories returned by the json query
-        if json_response:
-            json_result = json_response['result']['files']
-
-            for item in json_result:
-                # Handle numeric labels
-                alt_label = item["label"]
-                if item["label"].isnumeric():
-                    alt_label = "$NUMBER[%s]" % item["label"]
-
-                if location.startswith("library://"):
-                    # Process this as a library node
-                    is_library = True
-                    if widget_type is None:
-                        widget_type = self.node_func.get_media_type(location)
-
-                    if item_type == "32014":
-                        # Video node
-                        window_id = "Videos"
-                        if widget_type == "unknown":
-                            widget_type = "video"
-                        widget_target = "videos"
-
-                    else:
-                        # Audio node
-                        window_id = "Music"
-                        if widget_type == "unknown":
-                            widget_type = "audio"
-                        widget_target = "music"
-
-                    if item["filetype"] == "directory":
-                        thumb = None
-                        if item["thumbnail"] != "":
-                            thumb = item["thumbnail"]
-
-                        listitem = self.create(
-                            ["ActivateWindow(%s,%s,return)" % (window_id, item["file"]), alt_label,
-                             "", {
-                                 "icon": "DefaultFolder.png",
-                                 "thumb": thumb
-                             }]
-                        )
-
-                        if item["file"].endswith(".xml/") and \
-                                self.node_func.is_grouped(item["file"]):
-                            listitem = self.create([item["file"], "%s  >" % (item["label"]), "", {
-                                "icon": "DefaultFolder.png",
-                                "thumb": thumb
-                            }])
-
-                        # Add widget properties
-                        widget_name = "%s - %s" % (label[0].replace("  >", ""), item["label"])
-                        listitem.setProperty("widget", "Library")
-                        listitem.setProperty("widgetName", widget_name)
-                        listitem.setProperty("widgetType", widget_type)
-                        listitem.setProperty("widgetTarget", widget_target)
-                        listitem.setProperty("widgetPath", item["file"])
-
-                        listings.append(self._get_icon_overrides(tree, listitem, ""))
-
-                # some special code for smart shortcuts in script.skin.helper.service
-                elif item.get("title", None) == "smartshortcut":
-
-                    smart_shortcuts_data = ast.literal_eval(item.get("mpaa"))
-                    thumb = smart_shortcuts_data["background"]
-
-                    listitem = self.create([item["file"], alt_label, "", {
-                        "icon": item.get("icon"),
-                        "thumb": thumb
-                    }])
-                    # add all passed properties to the gui to set default background, widget etc.
-                    properties = []
-                    for key, value in list(smart_shortcuts_data.items()):
-                        properties.append([key, value])
-
-                    listitem.setProperty("smartShortcutProperties", repr(properties))
-                    listitem.setProperty("untranslatedIcon", thumb)
-                    listitem.setProperty("widget", smart_shortcuts_data.get("widget", "Addon"))
-                    listitem.setProperty("widgetName", item["label"])
-                    listitem.setProperty("widgetType", smart_shortcuts_data["type"])
-
-                    if smart_shortcuts_data["type"] == "music" or \
-                            smart_shortcuts_data["type"] == "artists" or \
-                            smart_shortcuts_data["type"] == "albums" or \
-                            smart_shortcuts_data["type"] == "songs":
-                        listitem.setProperty("widgetTarget", "music")
-
-                    else:
-                        listitem.setProperty("widgetTarget", "videos")
-
-                    listitem.setProperty("widgetPath", smart_shortcuts_data["list"])
-                    listings.append(self._get_icon_overrides(tree, listitem, ""))
-
-                else:
-                    # Process this as a plugin
-                    if item["filetype"] == "directory":
-                        thumb = None
-                        if item["thumbnail"] != "":
-                            thumb = item["thumbnail"]
-
-                        listitem = self.create([item["file"], "%s  >" % item['label'], "", {
-                            "icon": "DefaultFolder.png",
-                            "thumb": thumb
-                        }])
-                        listings.append(self._get_icon_overrides(tree, listitem, ""))
-
-                    else:
-                        content_type = self._detect_plugin_content(item)
-                        if content_type is not None:
-                            if addon_type is not None:
-                                addon_type = content_type
-
-                            else:
-                                if addon_type not in (content_type, 'mixed'):
-                                    addon_type = "mixed"
+        listings.extend(next(pages, []))
 
         # Close progress dialog
         dialog.close()
 
-        # Show select dialog
+        # Show select dialog, which will add the rest of the pages as they're listed
         get_more = self._allow_install_widget_provider(location, is_widget)
         show_dialog = ShowDialog(
-            "DialogSelect.xml", CWD, listing=listings, window_title=dialog_label, more=get_more
+            "DialogSelect.xml", CWD, listing=listings, window_title=dialog_label, more=get_more,
+            pages=pages
         )
         show_dialog.doModal()
         selected_item = show_dialog.result
+
+        if selected_item >= 0 and not state["complete"] and \
+                listings[selected_item].getProperty("path") == "::CREATE::":
+            # We need the rest of the directory to decide the widget type, but not its listitems
+            dialog = xbmcgui.DialogProgress()
+            dialog.create(dialog_label, LANGUAGE(32063))
+
+            show_dialog.stop_pages(wait=True)
+            state["properties"] = explorer_utils.EXPLORER_TYPE_PROPERTIES
+            state["build"] = False
+            for _ in pages:
+                pass
+
+            dialog.close()
+
+            if not state["complete"]:
+                log("Unable to list all of %s, the widget type may be wrong" % location)
+
+        else:
+            show_dialog.stop_pages()
+
         del show_dialog
 
+        is_library = state["is_library"]
+        addon_type = state["addon_type"]
+
         if selected_item == -2:
             # Get more button
             log("Selected get more button")
@@ -2022,6 +2111,170 @@ class LibraryFunctions:
 
         return None
 
+    def _explorer_pages(self, location, label, item_type, tree, state):
+        # List a directory for explorer, yielding the listitems of each part of it as it's
+        # listed. Unless state says to build them, only what's needed to decide the widget
+        # type is kept. If listing fails, state isn't marked as complete
+        key = (location, tuple(state["properties"]))
+        cached_responses = self.directory_cache.get(key)
+        if cached_responses is not None:
+            responses = cached_responses
+        else:
+            responses = explorer_utils.list_directory(location, state)
+
+        listed_responses = []
+        requested_properties = set()
+        for json_response in responses:
+            if json_response is None:
+                return
+
+            # Each part is requested with the properties asked for when it's listed
+            listed_responses.append(json_response)
+            requested_properties.add(tuple(state["properties"]))
+
+            # Add all directories returned by the json query, a page at a time - a plugin
+            # directory comes back in one part, which could take a while to build
+            page = []
+            for position, item in enumerate(json_response['result']['files']):
+                if page and position % explorer_utils.EXPLORER_PAGE_SIZE == 0:
+                    yield page
+                    page = []
+
+                if not state["build"]:
+                    if not location.startswith("library://") and \
+                            item.get("title", None) != "smartshortcut" and \
+                            item["filetype"] != "directory":
+                        content_type = self._detect_plugin_content(item)
+                        if content_type is not None:
+                            if state["addon_type"] is not None:
+                                state["addon_type"] = content_type
+
+                            else:
+                                if state["addon_type"] not in (content_type, 'mixed'):
+                                    state["addon_type"] = "mixed"
+
+                    continue
+
+                # Handle numeric labels
+                alt_label = item["label"]
+                if item["label"].isnumeric():
+                    alt_label = "$NUMBER[%s]" % item["label"]
+
+                if location.startswith("library://"):
+                    # Process this as a library node
+                    state["is_library"] = True
+                    if state["widget_type"] is None:
+                        state["widget_type"] = self.node_func.get_media_type(location)
+
+                    if item_type == "32014":
+                        # Video node
+                        window_id = "Videos"
+                        if state["widget_type"] == "unknown":
+                            state["widget_type"] = "video"
+                        widget_target = "videos"
+
+                    else:
+                        # Audio node
+                        window_id = "Music"
+                        if state["widget_type"] == "unknown":
+                            state["widget_type"] = "audio"
+                        widget_target = "music"
+
+                    if item["filetype"] == "directory":
+                        thumb = None
+                        if item["thumbnail"] != "":
+                            thumb = item["thumbnail"]
+
+                        listitem = self.create(
+                            ["ActivateWindow(%s,%s,return)" % (window_id, item["file"]), alt_label,
+                             "", {
+                                 "icon": "DefaultFolder.png",
+                                 "thumb": thumb
+                             }]
+                        )
+
+                        if item["file"].endswith(".xml/") and \
+                                self.node_func.is_grouped(item["file"]):
+                            listitem = self.create([item["file"], "%s  >" % (item["label"]), "", {
+                                "icon": "DefaultFolder.png",
+                                "thumb": thumb
+                            }])
+
+                        # Add widget properties
+                        widget_name = "%s - %s" % (label[0].replace("  >", ""), item["label"])
+                        listitem.setProperty("widget", "Library")
+                        listitem.setProperty("widgetName", widget_name)
+                        listitem.setProperty("widgetType", state["widget_type"])
+                        listitem.setProperty("widgetTarget", widget_target)
+                        listitem.setProperty("widgetPath", item["file"])
+
+                        page.append(self._get_icon_overrides(tree, listitem, ""))
+
+                # some special code for smart shortcuts in script.skin.helper.service
+                elif item.get("title", None) == "smartshortcut":
+
+                    smart_shortcuts_data = ast.literal_eval(item.get("mpaa"))
+                    thumb = smart_shortcuts_data["background"]
+
+                    listitem = self.create([item["file"], alt_label, "", {
+                        "icon": item.get("icon"),
+                        "thumb": thumb
+                    }])
+                    # add all passed properties to the gui to set default background, widget etc.
+                    properties = []
+                    for key, value in list(smart_shortcuts_data.items()):
+                        properties.append([key, value])
+
+                    listitem.setProperty("smartShortcutProperties", repr(properties))
+                    listitem.setProperty("untranslatedIcon", thumb)
+                    listitem.setProperty("widget", smart_shortcuts_data.get("widget", "Addon"))
+                    listitem.setProperty("widgetName", item["label"])
+                    listitem.setProperty("widgetType", smart_shortcuts_data["type"])
+
+                    if smart_shortcuts_data["type"] == "music" or \
+                            smart_shortcuts_data["type"] == "artists" or \
+                            smart_shortcuts_data["type"] == "albums" or \
+                            smart_shortcuts_data["type"] == "songs":
+                        listitem.setProperty("widgetTarget", "music")
+
+                    else:
+                        listitem.setProperty("widgetTarget", "videos")
+
+                    listitem.setProperty("widgetPath", smart_shortcuts_data["list"])
+                    page.append(self._get_icon_overrides(tree, listitem, ""))
+
+                else:
+                    # Process this as a plugin
+                    if item["filetype"] == "directory":
+                        thumb = None
+                        if item["thumbnail"] != "":
+                            thumb = item["thumbnail"]
+
+                        listitem = self.create([item["file"], "%s  >" % item['label'], "", {
+                            "icon": "DefaultFolder.png",
+                            "thumb": thumb
+                        }])
+                        page.append(self._get_icon_overrides(tree, listitem, ""))
+
+                    else:
+                        content_type = self._detect_plugin_content(item)
+                        if content_type is not None:
+                            if state["addon_type"] is not None:
+                                state["addon_type"] = content_type
+
+                            else:
+                                if state["addon_type"] not in (content_type, 'mixed'):
+                                    state["addon_type"] = "mixed"
+
+            yield page
+
+        # The whole listing is kept, so it expires all at once - unless what was asked for
+        # changed part way through
+        if cached_responses is None and requested_properties == {key[1]}:
+            self.directory_cache.set(key, listed_responses)
+
+        state["complete"] = True
+
     # ================================
     # === INSTALL WIDGET PROVIDERS ===
     # ================================
@@ -2045,6 +2298,7 @@ class LibraryFunctions:
         if selected_provider != -1:
             # User has selected a widget provider for us to install
             self._install_widget_provider(provider_list[selected_provider])
+            self.directory_cache.clear()
 
         # Return to where we were
         return self.explorer(history, history[len(history) - 1], label, thumbnail, item_type,
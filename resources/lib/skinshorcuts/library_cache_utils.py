@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+    Copyright (C) 2013-2021 Skin Shortcuts (script.skinshortcuts)
+    This file is part of script.skinshortcuts
+    SPDX-License-Identifier: GPL-2.0-only
+    See LICENSES/GPL-2.0-only.txt for more information.
+"""
+
+import hashlib
+import json
+import os
+import traceback
+
+import xbmc
+import xbmcgui
+import xbmcvfs
+
+from . import jsonrpc
+from .common import log
+from .common import read_file
+from .common import write_file
+from .constants import ADDON_VERSION
+from .constants import KODI_PATH
+from .constants import LIBRARY_CACHE_FILE
+from .constants import PROFILE_PATH
+
+# The groupings each library section fills, for the sections which are cached between sessions
+CACHED_GROUPINGS = {
+    "common": ["common"],
+    "more": ["commands"],
+    "videolibrary": ["video"],
+    "musiclibrary": ["music"],
+    "radiolibrary": ["radio"],
+    "librarysources": ["videosources", "musicsources", "picturesources"],
+    "playlists": ["playlist-video", "playlist-audio"],
+    "addons": ["addon-program", "addon-program-plugin", "addon-video", "addon-audio",
+               "addon-image"],
+    "favourites": ["favourite"],
+    "settings": ["settings"],
+    "widgets": ["widgets"]
+}
+
+# The properties LibraryFunctions sets on the listitems of the available shortcuts
+LISTITEM_PROPERTIES = (
+    "path", "localizedString", "shortcutType", "icon", "tempLabelID", "defaultLabel",
+    "untranslatedIcon", "thumbnail", "action", "action-play", "action-show", "action-party",
+    "widget", "widgetName", "widgetPath", "widgetTarget", "widgetType"
+)
+
+
+def listitem_to_dict(listitem):
+    # Return the label, art and properties of a listitem (or a folder of them) as plain data.
+    # Listitems which haven't been created yet return what they'll be created from
+    if isinstance(listitem, list):
+        return {"folder": listitem_to_dict(listitem[0]),
+                "items": [listitem_to_dict(item) for item in listitem[1]]}
+
+    if hasattr(listitem, "to_dict"):
+        return listitem.to_dict()
+
+    properties = {}
+    for name in LISTITEM_PROPERTIES:
+        value = listitem.getProperty(name)
+        if value:
+            properties[name] = value
+
+    return {
+        "label": listitem.getLabel(),
+        "label2": listitem.getLabel2(),
+        "icon": listitem.getArt("icon"),
+        "thumb": listitem.getArt("thumb"),
+        "properties": properties
+    }
+
+
+def listitem_from_dict(data, describe):
+    # Rebuild a listitem (or a folder of them) saved by listitem_to_dict, passing what
+    # a listitem which hadn't been created will be created from to describe
+    if "folder" in data:
+        return [listitem_from_dict(data["folder"], describe),
+                [listitem_from_dict(item, describe) for item in data["items"]]]
+
+    if "create" in data:
+        return describe(data)
+
+    listitem = xbmcgui.ListItem(label=data["label"], label2=data["label2"], offscreen=True)
+    if data["thumb"]:
+        listitem.setArt({
+            'icon': data["icon"],
+            'thumb': data["thumb"]
+        })
+    else:
+        listitem.setArt({
+            'icon': data["icon"]
+        })
+
+    for name, value in data["properties"].items():
+        listitem.setProperty(name, value)
+
+    return listitem
+
+
+def paths_token(*paths):
+    # Return a token which changes when any of the files (or anything within the directories)
+    # we've been passed are added, removed or modified
+    mtimes = []
+    for path in paths:
+        if not os.path.exists(path):
+            mtimes.append([path, None])
+            continue
+
+        mtimes.append([path, os.path.getmtime(path)])
+        if not os.path.isdir(path):
+            continue
+
+        for root, dirs, files in os.walk(path):
+            for name in dirs + files:
+                filename = os.path.join(root, name)
+                try:
+                    mtimes.append([filename, os.path.getmtime(filename)])
+                except OSError:
+                    mtimes.append([filename, None])
+
+    payload = json.dumps(sorted(mtimes, key=lambda mtime: mtime[0]))
+    return hashlib.md5(payload.encode("utf-8")).hexdigest()
+
+
+def addons_token():
+    # Return a token which changes when an add-on is installed, removed, updated,
+    # enabled or disabled
+    json_response = jsonrpc.addons_get_addons("unknown", ["version", "enabled"])
+    if not json_response:
+        return None
+
+    addons = sorted([item.get("addonid"), item.get("version"), item.get("enabled")]
+                    for item in json_response['result']['addons'])
+    payload = json.dumps(addons)
+    return hashlib.md5(payload.encode("utf-8")).hexdigest()
+
+
+def section_paths(library):
+    # Returns the files and directories a library section is built from, other than the
+    # overrides which every section depends on
+    if library == "favourites":
+        return [os.path.join(PROFILE_PATH, "favourites.xml")]
+
+    if library == "playlists":
+        return [xbmcvfs.translatePath("special://videoplaylists/"),
+                xbmcvfs.translatePath("special://musicplaylists/"),
+                xbmcvfs.translatePath("special://skin/playlists/"),
+                xbmcvfs.translatePath("special://skin/extras/")]
+
+    if library in ("videolibrary", "musiclibrary"):
+        node_library = library.replace("library", "")
+        return [os.path.join(PROFILE_PATH, "library", node_library),
+                os.path.join(KODI_PATH, "system", "library", node_library)]
+
+    if library == "librarysources":
+        return [os.path.join(PROFILE_PATH, "sources.xml")]
+
+    return []
+
+
+def conditions_unchanged(conditions):
+    # Returns whether the visibility conditions a cached section checked all still have
+    # the same result
+    if conditions is None:
+        return False
+
+    for condition, result in conditions.items():
+        if bool(xbmc.getCondVisibility(condition)) != result:
+            return False
+
+    return True
+
+
+def read_library_cache():
+    # The cache holds, for each section of the available shortcuts, the token it was built
+    # with and the plain data of its groupings
+    if xbmcvfs.exists(LIBRARY_CACHE_FILE):
+        try:
+            payload = json.loads(read_file(LIBRARY_CACHE_FILE))
+            if payload.get("version") == ADDON_VERSION:
+                return payload.get("sections", {})
+        except:
+            log(traceback.print_exc())
+            log("Unable to parse %s" % LIBRARY_CACHE_FILE)
+
+    return {}
+
+
+def write_library_cache(sections):
+    try:
+        payload = json.dumps({
+            "version": ADDON_VERSION,
+            "sections": sections
+        })
+        write_file(LIBRARY_CACHE_FILE, payload)
+    except:
+        log(traceback.print_exc())
+        log('Failed to write library cache to %s' % LIBRARY_CACHE_FILE)
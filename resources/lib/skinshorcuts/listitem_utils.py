@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+    Copyright (C) 2013-2021 Skin Shortcuts (script.skinshortcuts)
+    This file is part of script.skinshortcuts
+    SPDX-License-Identifier: GPL-2.0-only
+    See LICENSES/GPL-2.0-only.txt for more information.
+"""
+
+
+class LazyListItem:
+    # An available shortcut whose listitem is only created when it's shown. Holds what
+    # LibraryFunctions.create will create it from, and any changes made to it before then
+    __slots__ = ("library", "item", "allow_override_label", "label", "label_suffix", "properties",
+                 "listitem")
+
+    def __init__(self, library, item, allow_override_label=True):
+        self.library = library
+        self.item = item
+        self.allow_override_label = allow_override_label
+        self.label = None
+        self.label_suffix = ""
+        self.properties = {}
+        self.listitem = None
+
+    def get_listitem(self):
+        # Create the listitem, if it hasn't been already
+        if self.listitem is None:
+            listitem = self.library.create(self.item, self.allow_override_label)
+            if self.label is not None:
+                listitem.setLabel(self.label)
+            elif self.label_suffix:
+                listitem.setLabel(listitem.getLabel() + self.label_suffix)
+            for key, value in self.properties.items():
+                listitem.setProperty(key, value)
+
+            self.listitem = listitem
+
+        return self.listitem
+
+    def getLabel(self):  # pylint: disable=invalid-name
+        if self.listitem is None and self.label is not None:
+            return self.label
+        return self.get_listitem().getLabel()
+
+    def setLabel(self, label):  # pylint: disable=invalid-name
+        self.label = label
+        if self.listitem is not None:
+            self.listitem.setLabel(label)
+
+    def add_label_suffix(self, suffix):
+        # Append to the label, without creating the listitem to find out what the label is
+        if self.listitem is not None:
+            self.listitem.setLabel(self.listitem.getLabel() + suffix)
+        elif self.label is not None:
+            self.label += suffix
+        else:
+            self.label_suffix += suffix
+
+    def getProperty(self, key):  # pylint: disable=invalid-name
+        if self.listitem is None and key in self.properties:
+            return self.properties[key]
+        return self.get_listitem().getProperty(key)
+
+    def setProperty(self, key, value):  # pylint: disable=invalid-name
+        self.properties[key] = value
+        if self.listitem is not None:
+            self.listitem.setProperty(key, value)
+
+    def to_dict(self):
+        return {
+            "create": self.item,
+            "allow_override_label": self.allow_override_label,
+            "label": self.label,
+            "label_suffix": self.label_suffix,
+            "properties": self.properties
+        }
+
+
+def lazy_listitem_from_dict(library, data):
+    # Rebuild an available shortcut saved by LazyListItem.to_dict
+    lazy_item = LazyListItem(library, data["create"], data["allow_override_label"])
+    if data["label"] is not None:
+        lazy_item.setLabel(data["label"])
+    lazy_item.label_suffix = data.get("label_suffix", "")
+    for key, value in data["properties"].items():
+        lazy_item.setProperty(key, value)
+
+    return lazy_item
+
+
+def get_listitem(item):
+    # Return the listitem of an available shortcut, creating it if it hasn't been
+    if isinstance(item, LazyListItem):
+        return item.get_listitem()
+
+    return item
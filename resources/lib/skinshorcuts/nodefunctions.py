@@ -14,6 +14,7 @@ import xbmcgui
 import xbmcvfs
 
 from . import jsonrpc
+from .catalogue_utils import update_catalogue
 from .common import log
 from .common_utils import ShowDialog
 from .constants import ADDON_NAME
@@ -456,6 +457,9 @@ class NodeFunctions:
             path = data_func.data_xml_filename(DATA_PATH, data_func.slugify(new_label_id, True))
             menuitems.write(path, encoding="UTF-8")
 
+        # Record the menu files in the catalogue
+        update_catalogue()
+
         # Mark that the menu needs to be rebuilt
         HOME_WINDOW.setProperty("skinshortcuts-reloadmainmenu", "True")
 
@@ -575,6 +579,7 @@ class NodeFunctions:
         data_func.indent(menuitems.getroot())
         path = data_func.data_xml_filename(DATA_PATH, data_func.slugify(group, True))
         menuitems.write(path, encoding="UTF-8")
+        update_catalogue()
 
         log("Properties updated")
 
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+    Copyright (C) 2013-2021 Skin Shortcuts (script.skinshortcuts)
+    This file is part of script.skinshortcuts
+    SPDX-License-Identifier: GPL-2.0-only
+    See LICENSES/GPL-2.0-only.txt for more information.
+"""
+
+import json
+import os
+import threading
+import traceback
+import xml.etree.ElementTree as ETree
+
+import xbmcvfs
+
+from .common import log
+from .common import read_file
+from .common import write_file
+from .constants import PLAYLIST_INDEX_FILE
+
+# The index is read and written by both the library and the gui, so they take it in turns
+INDEX_LOCK = threading.Lock()
+
+
+def read_playlist_index():
+    # The index holds, for each smart playlist we've read, its modified time, the type of
+    # the <smartplaylist />, whether it has a <name /> and the name
+    if xbmcvfs.exists(PLAYLIST_INDEX_FILE):
+        try:
+            return json.loads(read_file(PLAYLIST_INDEX_FILE))
+        except:
+            log(traceback.print_exc())
+            log("Unable to parse %s" % PLAYLIST_INDEX_FILE)
+
+    return {}
+
+
+def write_playlist_index(updates):
+    # Add the playlists we've read to the index, and remove any which no longer exist
+    with INDEX_LOCK:
+        index = read_playlist_index()
+        index.update(updates)
+
+        for filename in list(index.keys()):
+            if not os.path.exists(filename):
+                del index[filename]
+
+        try:
+            write_file(PLAYLIST_INDEX_FILE, json.dumps(index))
+        except:
+            log(traceback.print_exc())
+            log('Failed to write playlist index to %s' % PLAYLIST_INDEX_FILE)
+
+
+def get_playlist_metadata(filename, index, updates):
+    # Return the type, whether it has a name, and the name of a smart playlist - from the index
+    # if it hasn't changed since it was last read, or by reading only as far as its <name />
+    mtime = os.path.getmtime(filename)
+    if filename in index and index[filename][0] == mtime:
+        return index[filename][1:]
+
+    media_type = None
+    has_name = False
+    name = None
+    for event, elem in ETree.iterparse(filename, events=("start", "end")):
+        if event == "start" and elem.tag == "smartplaylist":
+            media_type = elem.attrib['type']
+
+        elif event == "end" and elem.tag == "name":
+            has_name = True
+            name = elem.text
+            break
+
+    updates[filename] = [mtime, media_type, has_name, name]
+    return media_type, has_name, name
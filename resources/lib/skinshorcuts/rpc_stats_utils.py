@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+    Copyright (C) 2013-2021 Skin Shortcuts (script.skinshortcuts)
+    This file is part of script.skinshortcuts
+    SPDX-License-Identifier: GPL-2.0-only
+    See LICENSES/GPL-2.0-only.txt for more information.
+"""
+
+import json
+import threading
+import traceback
+
+import xbmc
+import xbmcvfs
+
+from .common import log
+from .common import read_file
+from .common import write_file
+from .constants import ADDON
+from .constants import HOME_WINDOW
+from .constants import RPC_STATS_FILE
+
+# The upper bounds, in milliseconds, of the buckets JSON-RPC latencies are counted in. Anything
+# slower goes in a final bucket of its own
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+# How much of a request or response is logged when the bodies are asked for, and whether they
+# are (read once, as every JSON-RPC call checks it)
+LOG_LIMIT = 2048
+LOG_BODIES = ADDON.getSettingBool("rpc_log_responses")
+
+# The stats of each JSON-RPC method called by this run of the script. As they're kept as
+# histograms, they can be added to the stats saved by earlier runs
+STATS = {}
+STATS_LOCK = threading.Lock()
+
+# How many tenths of a second a run waits for another run of the script to finish writing its
+# stats, before it writes its own anyway
+WRITE_WAIT = 50
+
+
+def new_stats():
+    return {
+        "count": 0,
+        "errors": 0,
+        "request_size": 0,
+        "response_size": 0,
+        "max_ms": 0,
+        "histogram": [0] * (len(LATENCY_BUCKETS) + 1)
+    }
+
+
+def record(method, elapsed, request, payload, errors):
+    # Count a call of method which Kodi took elapsed seconds to answer (not counting encoding
+    # the request or decoding the response), sent the request string and received the payload
+    # string, and log it
+    elapsed_ms = elapsed * 1000
+    bucket = len(LATENCY_BUCKETS)
+    for position, bound in enumerate(LATENCY_BUCKETS):
+        if elapsed_ms <= bound:
+            bucket = position
+            break
+
+    with STATS_LOCK:
+        stats = STATS.setdefault(method, new_stats())
+        stats["count"] += 1
+        stats["errors"] += errors
+        stats["request_size"] += len(request)
+        stats["response_size"] += len(payload)
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+        stats["histogram"][bucket] += 1
+
+    log('JSONRPC: %s took %.1fms, sent %d and received %d characters, %d errors' %
+        (method, elapsed_ms, len(request), len(payload), errors))
+    if LOG_BODIES:
+        log('JSONRPC: Requested |%s| received |%s|' % (truncate(request), truncate(payload)))
+
+
+def truncate(text):
+    if len(text) <= LOG_LIMIT:
+        return text
+    return '%s... (%d more characters)' % (text[:LOG_LIMIT], len(text) - LOG_LIMIT)
+
+
+def merge(stats, other):
+    # Add the stats of other to stats. Stats counted with other buckets can't be added to,
+    # so are replaced
+    for method, method_stats in other.items():
+        totals = stats.get(method)
+        if totals is None or len(totals["histogram"]) != len(method_stats["histogram"]):
+            stats[method] = dict(method_stats, histogram=list(method_stats["histogram"]))
+            continue
+
+        for name in ("count", "errors", "request_size", "response_size"):
+            totals[name] += method_stats[name]
+        totals["max_ms"] = max(totals["max_ms"], method_stats["max_ms"])
+        totals["histogram"] = [count + other_count for count, other_count in
+                               zip(totals["histogram"], method_stats["histogram"])]
+
+    return stats
+
+
+def percentile(stats, fraction):
+    # The latency, in milliseconds, which the fraction of calls took no longer than - to the
+    # nearest bucket
+    needed = stats["count"] * fraction
+    seen = 0
+    for position, count in enumerate(stats["histogram"]):
+        seen += count
+        if count and seen >= needed:
+            if position < len(LATENCY_BUCKETS):
+                return min(LATENCY_BUCKETS[position], stats["max_ms"])
+            break
+
+    return stats["max_ms"]
+
+
+def read_rpc_stats():
+    if xbmcvfs.exists(RPC_STATS_FILE):
+        try:
+            return json.loads(read_file(RPC_STATS_FILE))
+        except:
+            log(traceback.print_exc())
+            log("Unable to parse %s" % RPC_STATS_FILE)
+
+    return {}
+
+
+def write_rpc_stats():
+    # Add the stats of this run to those saved by earlier runs, if they're being recorded.
+    # Each run of the script has its own STATS_LOCK, so runs which write at the same time would
+    # lose each others counts. A home window property marks that a run is writing - but as it's
+    # checked and then set, two runs which check it at the same moment will both still write
+    if not ADDON.getSettingBool("rpc_stats"):
+        return
+
+    with STATS_LOCK:
+        if not STATS:
+            return
+
+        run_stats = dict(STATS)
+        STATS.clear()
+
+    monitor = xbmc.Monitor()
+    for _ in range(WRITE_WAIT):
+        if HOME_WINDOW.getProperty("skinshortcuts-rpcstats-writing") != "True" or \
+                monitor.waitForAbort(0.1):
+            break
+
+    HOME_WINDOW.setProperty("skinshortcuts-rpcstats-writing", "True")
+    try:
+        stats = merge(read_rpc_stats(), run_stats)
+        write_file(RPC_STATS_FILE, json.dumps(stats))
+    except:
+        log(traceback.print_exc())
+        log('Failed to write JSON-RPC stats to %s' % RPC_STATS_FILE)
+    finally:
+        HOME_WINDOW.clearProperty("skinshortcuts-rpcstats-writing")
+
+
+def format_rpc_stats(stats):
+    # One line for each method, slowest first
+    lines = []
+    methods = sorted(stats.items(), key=lambda item: percentile(item[1], 0.9), reverse=True)
+    for method, method_stats in methods:
+        count = method_stats["count"]
+        lines.append(
+            '%s: %d calls, %d errors, p50 %.1fms, p90 %.1fms, p99 %.1fms, max %.1fms, '
+            'avg sent %d, avg received %d' %
+            (method, count, method_stats["errors"], percentile(method_stats, 0.5),
+             percentile(method_stats, 0.9), percentile(method_stats, 0.99),
+             method_stats["max_ms"], method_stats["request_size"] // max(count, 1),
+             method_stats["response_size"] // max(count, 1))
+        )
+
+    return "\n".join(lines)
@@ -25,7 +25,9 @@ from . import datafunctions
 from . import jsonrpc
 from . import library
 from . import nodefunctions
+from . import rpc_stats_utils
 from . import xmlfunctions
+from .catalogue_utils import update_catalogue
 from .common import log
 from .constants import ADDON_NAME
 from .constants import CWD
@@ -58,7 +60,7 @@ class Script:
         """
         valid_routes = (
             'buildxml', 'launch', 'launchpvr', 'manage', 'hidesubmenu', 'resetlist',
-            'shortcuts', 'widgets', 'context', 'setProperty', 'resetall'
+            'shortcuts', 'widgets', 'context', 'setProperty', 'resetall', 'rpcstats'
         )
 
         if not self.TYPE:
@@ -75,7 +77,11 @@ class Script:
             return
 
         route_method = getattr(self, route_attrib)
-        route_method()
+        try:
+            route_method()
+        finally:
+            # Keep the stats of this run, even if it failed
+            rpc_stats_utils.write_rpc_stats()
         return
 
     def route_buildxml(self):
@@ -123,6 +129,13 @@ class Script:
         self.node_func.set_properties(self.PROPERTIES, self.VALUES, self.LABELID,
                                       self.GROUPNAME, self.data_func)
 
+    @staticmethod
+    def route_rpcstats():
+        # Show the JSON-RPC stats recorded so far
+        stats = rpc_stats_utils.format_rpc_stats(rpc_stats_utils.read_rpc_stats())
+        log('JSONRPC stats:\n%s' % stats)
+        xbmcgui.Dialog().textviewer(ADDON_NAME, stats or LANGUAGE(32129))
+
     def route_shortcuts(self):
         # We're just going to choose a shortcut, and save its details to the given
         # skin labels
@@ -397,6 +410,9 @@ class Script:
                         else:
                             log("Not deleting file %s" % file)
 
+            # Record the remaining menu files in the catalogue
+            update_catalogue()
+
             # Update home window property (used to automatically refresh type=settings)
             HOME_WINDOW.setProperty("skinshortcuts", strftime("%Y%m%d%H%M%S", gmtime()))
 
@@ -7,17 +7,73 @@
 """
 
 import ast
-import operator
+import hashlib
+import json
 import os
+import re
+import time
+import traceback
 import xml.etree.ElementTree as ETree
+from collections import deque
 
 import xbmc
 import xbmcvfs
 from simpleeval import SimpleEval
-from simpleeval import simple_eval
 
 from .common import log
+from .common import read_file
+from .common import write_file
+from .constants import ADDON_VERSION
 from .constants import SKIN_SHORTCUTS_PATH
+from .constants import TEMPLATE_MEMO_FILE
+from .hash_utils import generate_file_hash
+
+# A tag that ElementTree.findall will only match against the tag of child elements
+SIMPLE_TAG = re.compile(r"[^/\[\]()@!=\s.*:][^/\[\]()@!=\s]*$")
+
+
+class ItemFeatures:
+    # The child elements of a menu item, indexed by tag, by tag and attribute name, and by tag,
+    # attribute name and attribute value, so templates can be matched against the item
+    # without searching it again for every condition and property
+    def __init__(self, item):
+        self.item = item
+        self.index = {}
+
+        for child in item:
+            self.index.setdefault((child.tag, None, None), []).append(child.text)
+            for name, value in child.attrib.items():
+                self.index.setdefault((child.tag, name, None), []).append(child.text)
+                self.index.setdefault((child.tag, name, value), []).append(child.text)
+
+    def texts(self, tag, attrib=None):
+        # Returns the text of each child element with the tag, and if attrib is given as
+        # [name] or [name, value], that has the attribute
+        name = None
+        value = None
+        if attrib is not None:
+            name = attrib[0]
+            if len(attrib) > 1:
+                value = attrib[1]
+
+        if SIMPLE_TAG.match(tag) is None:
+            # The tag is a path, so search the item for it
+            return [elem.text for elem in self.item.findall(tag)
+                    if name is None or (name in elem.attrib and
+                                        value in (None, elem.attrib.get(name)))]
+
+        return self.index.get((tag, name, value), [])
+
+    def matches(self, tag, attrib, text):
+        # Check if a <condition /> of an 'other' template matches the item
+        if tag is None:
+            return False
+
+        texts = self.texts(tag, attrib)
+        if text is None:
+            return len(texts) != 0
+
+        return text in texts
 
 
 class Template:
@@ -26,6 +82,26 @@ class Template:
         self.templatepath = os.path.join(SKIN_SHORTCUTS_PATH, "template.xml")
         self.other_templates = []
 
+        # The placeholders found in each string of template.xml, keyed by marker and string
+        self.compiled_strings = {}
+
+        # The properties of each propertyGroup, keyed by the groups lowercase name
+        self.property_groups = {}
+
+        # The conditions and properties of each template, compiled to be matched against
+        # the ItemFeatures of each menu item
+        self.compiled_conditions = {}
+        self.compiled_properties = {}
+
+        # A name for each template (and each 'other' template in finalize), to use in the report
+        # and the memo
+        self.template_names = {}
+
+        # What each template built in the last build with this template.xml, keyed by a digest of
+        # the template and what it was built with, and what it has built (or reused) in this one
+        self.memo = {}
+        self.memo_used = {}
+
         try:
             self.tree = ETree.parse(self.templatepath)
 
@@ -43,6 +119,9 @@ class Template:
                 if include_name not in self.other_templates:
                     self.other_templates.append(include_name)
 
+            self.compile_template()
+            self.memo = self.read_memo()
+
         except:
             # We couldn't load the template.xml file
             if xbmcvfs.exists(self.templatepath):
@@ -55,6 +134,15 @@ class Template:
         # Empty variable which will contain our base elementree (passed from buildxml)
         self.includes = None
 
+        # The <include /> elements in our base elementree, by name, and the conditional
+        # includes within them, by name and condition
+        self.include_elements = {}
+        self.include_conditions = {}
+
+        # Empty report which will contain the time spent in and the work done by each template,
+        # if the skinner has enabled it (passed from buildxml)
+        self.report = None
+
         # Empty progress which will contain the Kodi progress dialog gui (passed from buildxml)
         self.progress = None
         self.percent = None
@@ -63,10 +151,19 @@ class Template:
         # List which will contain 'other' elements we will need to finalize (we won't have all the
         # visibility conditions until the end)
         self.finalize = []
+        # The 'other' elements in finalize, keyed by their include name and the digests of their
+        # controls and variables, to find identical templates without comparing against each one
+        self.finalize_digests = {}
+
+        # What each template has built, keyed by the template and what it was built with, so
+        # it can be reused (mainmenu and submenu templates keep their controls, 'other'
+        # templates their digest in finalize_digests)
+        self.rendered_templates = {}
+        self.rendered_others = {}
 
-        # Initialize simple eval
+        # Initialize simple eval, and the $PYTHON[] expressions it has parsed
         self.simple_eval = SimpleEval()
-        self.simple_eval.operators[ast.In] = operator.contains
+        self.parsed_expressions = {}
 
         self.hashable = set()
         self.hashable.add(self.templatepath)
@@ -80,17 +177,15 @@ class Template:
 
         # Get the template for this menu
         if menu_type == "mainmenu":
-            template = self.tree.find("mainmenu")
-            if template is not None:
-                template = self.copy_tree(template)
+            template_source = self.tree.find("mainmenu")
 
         else:
             if len(items.findall("item")) == 0:
                 return
 
-            template = self.find_submenu(menu_name, level)
+            template_source = self.find_submenu(menu_name, level)
 
-        if template is not None:
+        if template_source is not None:
             # Found a template - let's build it
             if menu_type == "mainmenu":
                 log("Main menu template found")
@@ -100,26 +195,62 @@ class Template:
             # We need to check that the relevant includes existing
             # First, the overarching include
             include_name = "skinshortcuts-template"
-            if "include" in template.attrib:
-                include_name += "-%s" % template.attrib.get("include")
+            if "include" in template_source.attrib:
+                include_name += "-%s" % template_source.attrib.get("include")
 
-            _ = self.get_include(self.includes, include_name, profile_visibility, profile)
-            include_tree = self.get_include(self.includes, "%s-%s" % (include_name, profile),
-                                            None, None)
+            _ = self.get_include(include_name, profile_visibility, profile)
+            include_tree = self.get_include("%s-%s" % (include_name, profile), None, None)
 
             # If we've been passed any mainmenu items, retrieve their properties
             properties = {}
             if mainmenuitems is not None:
-                properties = self.get_properties(template, mainmenuitems)
+                properties = self.get_properties(template_source, mainmenuitems)
+
+            # If we've already built this template with the same items and properties (such as
+            # for another profile with the same menu), add a copy of what we built then
+            started = time.time()
+            render_key = self.get_render_key(template_source, items, properties,
+                                             visibility_condition, profile_visibility)
+            reused = render_key in self.rendered_templates
+            memo_key = None
+            if not reused:
+                memo_key = self.get_memo_key(template_source,
+                                             (visibility_condition, sorted(properties.items()),
+                                              render_key[4]), render_key[3])
+
+            if reused:
+                for child in self.rendered_templates[render_key]:
+                    include_tree.append(self.copy_tree(child))
+
+            elif memo_key in self.memo:
+                # Or the same as the last build, so add what we built then
+                self.memo_used[memo_key] = self.memo[memo_key]
+                self.rendered_templates[render_key] = [self.tree_from_memo(child)
+                                                       for child in self.memo[memo_key]]
+                for child in self.rendered_templates[render_key]:
+                    include_tree.append(child)
+
+                self.add_to_report(template_source, memo_hits=1)
+
+            else:
+                # Now replace all <skinshortcuts> elements with correct data
+                template = self.copy_tree(template_source)
+                self.replace_elements(template.find("controls"), visibility_condition,
+                                      profile_visibility, items, properties,
+                                      customitems=template_source.findall("items"))
 
-            # Now replace all <skinshortcuts> elements with correct data
-            self.replace_elements(template.find("controls"), visibility_condition,
-                                  profile_visibility, items, properties,
-                                  customitems=template.findall("items"))
+                # Add the template to the includes
+                self.rendered_templates[render_key] = list(template.find("controls"))
+                for child in self.rendered_templates[render_key]:
+                    include_tree.append(child)
+
+                self.memo_used[memo_key] = [self.tree_to_memo(child)
+                                            for child in self.rendered_templates[render_key]]
 
-            # Add the template to the includes
-            for child in template.find("controls"):
-                include_tree.append(child)
+            num_items = len(items.findall("item"))
+            self.add_to_report(template_source, started, tested=num_items, matched=num_items,
+                               dedupe_hits=int(reused),
+                               controls=len(self.rendered_templates[render_key]))
 
         # Now we want to see if any of the main menu items match a template
         if not build_others or len(self.other_templates) == 0:
@@ -196,8 +327,10 @@ class Template:
         if len(self.finalize) == 0:
             return
 
+        # The condition/value pairs of each variable for each profile, and the names of the
+        # variables (dicts are used as ordered sets, to keep the order they're found in)
         final_variables = {}
-        final_variable_names = []
+        final_variable_names = {}
 
         for template in self.finalize:
             # Get the group name
@@ -223,13 +356,13 @@ class Template:
                         visibility_condition += " | %s" % condition.text
 
                 # Get the include this will be done under
-                _ = self.get_include(self.includes, name, profile.attrib.get("visible"),
+                _ = self.get_include(name, profile.attrib.get("visible"),
                                      profile.attrib.get("profile"))
-                include = self.get_include(self.includes, "%s-%s" %
-                                           (name, profile.attrib.get("profile")),
+                include = self.get_include("%s-%s" % (name, profile.attrib.get("profile")),
                                            None, None)  # profile.attrib.get( "visible" ) )
 
                 # Create a copy of the node with any changes within (this time it'll be visibility)
+                started = time.time()
                 final = self.copy_tree(template)
                 self.replace_elements(final, visibility_condition,
                                       profile.attrib.get("visible"), [])
@@ -240,6 +373,8 @@ class Template:
                     for child in controls:
                         include.append(child)
 
+                    self.add_to_report(template, started, controls=len(controls))
+
                 # Process the variables
                 variables = final.find("variables")
                 if variables is not None:
@@ -251,13 +386,11 @@ class Template:
 
                         # Save the variable name
                         var_name = variable.attrib.get("name")
-                        if var_name not in final_variable_names:
-                            final_variable_names.append(var_name)
+                        final_variable_names[var_name] = None
 
                         # Get any existing values for this profile + variable
-                        new_variables = []
-                        if var_name in final_variables[profile_visibility]:
-                            new_variables = final_variables[profile_visibility][var_name]
+                        profile_variables = final_variables[profile_visibility]
+                        new_variables = profile_variables.setdefault(var_name, {})
 
                         # Loop through new values provided by this template
                         for value in variable.findall("value"):
@@ -265,13 +398,8 @@ class Template:
                             if "condition" in value.attrib:
                                 condition = value.attrib.get("condition")
 
-                            # Add the new condition/value pair only if it really is new
-                            new_value = (condition, value.text)
-                            if new_value not in new_variables:
-                                new_variables.append(new_value)
-
-                        # Add the values into the dict
-                        final_variables[profile_visibility][var_name] = new_variables
+                            # Add the new condition/value pair (if it really is new)
+                            new_variables[(condition, value.text)] = None
 
         # And now write the variables
         for variable_name in final_variable_names:
@@ -286,7 +414,7 @@ class Template:
         # If there are any 'other' templates that we haven't built, build an empty one
         for other_template in self.other_templates:
             # Get the include this will be built in
-            root = self.get_include(self.includes, other_template, None, None)
+            root = self.get_include(other_template, None, None)
             ETree.SubElement(root, "description").text = \
                 "This include was built automatically as the template didn't match any menu items"
 
@@ -297,84 +425,67 @@ class Template:
         return_variables = []
         no_condition = []
 
-        # Firstly, lets pull out the specific variables from all the variables we've been passed
-        limited_variables = {}
+        # Group the condition/value pairs by the profiles that have them, in the order
+        # the pairs are first found
+        value_profiles = {}
+        num_profiles = 0
         for profile in all_variables:
-            if variable_name in all_variables[profile]:
-                limited_variables[profile] = all_variables[profile][variable_name]
-
-        num_profiles = len(limited_variables)
-        for profile in list(limited_variables.keys()):
-            while len(limited_variables[profile]) != 0:
-                # Grab the first value from the list
-                value = limited_variables[profile].pop(0)
-                profiles = [profile]
-
-                # Now check if any other profile has that value
-                for additional_profile in list(limited_variables.keys()):
-                    if value in limited_variables[additional_profile]:
-                        # It does - remove it and add the profile visibility
-                        # to the one we already have
-                        profiles.append(additional_profile)
-                        limited_variables[additional_profile].remove(value)
-
-                # Check if we need to add profile visibility
-                if len(profiles) == num_profiles:
-                    # We don't
-                    if value[0] == "":
-                        no_condition.append(value)
-                    else:
-                        return_variables.append(value)
+            if variable_name not in all_variables[profile]:
+                continue
 
+            num_profiles += 1
+            for value in all_variables[profile][variable_name]:
+                value_profiles.setdefault(value, []).append(profile)
+
+        for value, profiles in value_profiles.items():
+            # Check if we need to add profile visibility
+            if len(profiles) == num_profiles:
+                # We don't
+                if value[0] == "":
+                    no_condition.append(value)
                 else:
-                    # We do
-                    condition = None
-                    for profile_visibility in profiles:
-                        if condition is None:
-                            condition = profile_visibility
-                        else:
-                            condition = "%s | %s" % (condition, profile_visibility)
+                    return_variables.append(value)
 
-                    if value[0] == "":
-                        no_condition.append((condition, value[1]))
-                    else:
-                        return_variables.append(("%s + [%s]" % (condition, value[0]), value[1]))
+            else:
+                # We do
+                condition = " | ".join(profiles)
+
+                if value[0] == "":
+                    no_condition.append((condition, value[1]))
+                else:
+                    return_variables.append(("%s + [%s]" % (condition, value[0]), value[1]))
 
         return return_variables + no_condition
 
-    @staticmethod
-    def get_include(tree, name, condition, profile):
-        # This function gets an existing <include/>, or creates it
-        for include in tree.findall("include"):
-            if include.attrib.get("name") == name:
-                if condition is None:
-                    return include
+    def add_include(self, name):
+        # Create a new <include /> in our base elementree, and add it to the registry
+        # so get_include can find it
+        include = ETree.SubElement(self.includes, "include")
+        include.set("name", name)
 
-                # We've been passed a condition, check there's an include with that
-                # as condition and name as text
-                for vis_include in include.findall("include"):
-                    if vis_include.attrib.get("condition") == condition:
-                        return include
+        if name not in self.include_elements:
+            self.include_elements[name] = include
 
-                # We didn't find condition,so create it
-                vis_include = ETree.SubElement(include, "include")
-                vis_include.set("condition", condition)
-                vis_include.text = "%s-%s" % (name, profile)
+        return include
 
-                return include
+    def get_include(self, name, condition, profile):
+        # This function gets an existing <include/>, or creates it
+        include = self.include_elements.get(name)
+        if include is None:
+            # We didn't find the node, so create it
+            include = self.add_include(name)
 
-        # We didn't find the node, so create it
-        new_include = ETree.SubElement(tree, "include")
-        new_include.set("name", name)
+        if condition is None or (name, condition) in self.include_conditions:
+            return include
 
-        # If we've been passed a condition, create an include with that as condition
-        # and name as text
-        if condition is not None:
-            vis_include = ETree.SubElement(new_include, "include")
-            vis_include.set("condition", condition)
-            vis_include.text = "%s-%s" % (name, profile)
+        # We've been passed a condition that isn't there yet, so create an include
+        # with that as condition and name as text
+        vis_include = ETree.SubElement(include, "include")
+        vis_include.set("condition", condition)
+        vis_include.text = "%s-%s" % (name, profile)
+        self.include_conditions[(name, condition)] = vis_include
 
-        return new_include
+        return include
 
     def find_submenu(self, name, level):
         # Find the correct submenu template
@@ -399,17 +510,14 @@ class Template:
             if "name" in elem.attrib:
                 if elem.attrib.get("name") == name:
                     # This is the one we want :)
-                    return self.copy_tree(elem)
+                    return elem
 
                 continue
 
             # Save this, in case we don't find a better match
             return_elem = elem
 
-        if return_elem is None:
-            return None
-
-        return self.copy_tree(return_elem)
+        return return_elem
 
     def find_other(self, item, profile, profile_visibility, simple_visibility, visibility_condition,
                    menu_type, root_id):
@@ -421,6 +529,9 @@ class Template:
         if menu_type != "mainmenu":
             search_type = "submenuOther"
 
+        # Index the item once, to match it against every template
+        features = ItemFeatures(item)
+
         for elem in self.tree.findall(search_type):
             # Check that we don't already have a template for this include
             include_name = None
@@ -430,9 +541,6 @@ class Template:
             if include_name in found_template_includes:
                 continue
 
-            template = self.copy_tree(elem)
-            matched = True
-
             final_visibility = visibility_condition
             if menu_type != "mainmenu":
                 # This isn't the main menu
@@ -454,85 +562,58 @@ class Template:
                 else:
                     final_visibility = simple_visibility
 
-            # Check whether the skinner has set the match type
-            # (whether all conditions need to match, or any)
-            match_type = "all"
-            match_elem = template.find("match")
-            if match_elem is not None:
-                match_type = match_elem.text.lower()
-                if match_type not in ["any", "all"]:
-                    log("Invalid <match /> element in template")
-                    match_type = "all"
-
-                elif match_type == "any":
-                    matched = False
-
             # Check the conditions
-            for condition in template.findall("condition"):
-                if match_type == "all":
-                    if matched is False:
-                        break
-
-                    if self.check_condition(condition, item) is False:
-                        matched = False
-                        break
-
-                else:
-                    if True in (matched, self.check_condition(condition, item)):
-                        matched = True
-                        break
+            started = time.time()
+            match_type, conditions = self.get_conditions(elem)
+            if match_type == "any":
+                matched = any(features.matches(*condition) for condition in conditions)
+            else:
+                matched = all(features.matches(*condition) for condition in conditions)
 
             # If the conditions didn't match, we're done here
             if matched is False:
+                self.add_to_report(elem, started, tested=1)
                 continue
 
             num_templates += 1
 
             # All the rules matched, so next we'll get any properties
-            properties = self.get_properties(template, item)
+            properties = self.get_properties(elem, item, features)
             if root_id is not None:
                 properties["auto-rootID"] = root_id
 
-            # Next up, we do any replacements - EXCEPT for visibility, which
-            # we'll store for later (in case multiple items would have an
-            # identical template
-            self.replace_elements(template.find("controls"), None, None, [], properties)
-            self.replace_elements(template.find("variables"), None, None, [], properties)
+            # Next up, we do any replacements (unless we've already built this template with the
+            # same properties, such as for another profile or an identical item)
+            render_key = (elem, frozenset(properties.items()))
+            template = None
+            if render_key in self.rendered_others:
+                digest = self.rendered_others[render_key]
+            else:
+                template, digest = self.render_other(elem, include_name, properties)
+                self.rendered_others[render_key] = digest
 
             # Now we need to check if we've already got a template identical to this
             found_in_previous = False
-            for previous in self.finalize:
-                # Check that the previous template uses the same include
-                include_name_check = include_name
-                if include_name is None:
-                    include_name_check = "NONE"
-
-                if previous.find("skinshortcuts-includeName").text != include_name_check:
-                    continue
-
-                # Compare templates
-                if self.compare_tree(template.find("controls"), previous.find("controls")) and \
-                        self.compare_tree(template.find("variables"), previous.find("variables")):
-                    # They are the same
-
-                    # Add our details to the previous version, so we can build it
-                    # with full visibility details later
-                    for profile_match in previous.findall("skinshortcuts-profile"):
-                        if profile_match.attrib.get("profile") == profile:
-                            # Check if we've already added this visibilityCondition
-                            for visible in profile_match.findall("visible"):
-                                if visible.text == final_visibility:
-                                    # The condition is already there
-                                    found_in_previous = True
-
-                            # We didn't find it, so add it
-                            if not found_in_previous:
-                                ETree.SubElement(profile_match, "visible").text = final_visibility
+            previous = self.finalize_digests.get(digest)
+            if previous is not None:
+                # They are the same
+
+                # Add our details to the previous version, so we can build it
+                # with full visibility details later
+                for profile_match in previous.findall("skinshortcuts-profile"):
+                    if profile_match.attrib.get("profile") == profile:
+                        # Check if we've already added this visibilityCondition
+                        for visible in profile_match.findall("visible"):
+                            if visible.text == final_visibility:
+                                # The condition is already there
                                 found_in_previous = True
 
-                    if found_in_previous is True:
-                        break
+                        # We didn't find it, so add it
+                        if not found_in_previous:
+                            ETree.SubElement(profile_match, "visible").text = final_visibility
+                            found_in_previous = True
 
+                if found_in_previous is False:
                     # We didn't find this profile, so add it
                     new_element = ETree.SubElement(previous, "skinshortcuts-profile")
                     new_element.set("profile", profile)
@@ -547,6 +628,9 @@ class Template:
 
             if found_in_previous is False:
                 # We don't have this template saved, so add our profile details to it
+                if template is None:
+                    template, digest = self.render_other(elem, include_name, properties)
+
                 new_element = ETree.SubElement(template, "skinshortcuts-profile")
                 new_element.set("profile", profile)
                 new_element.set("visible", profile_visibility)
@@ -562,67 +646,153 @@ class Template:
 
                 # Add it to our finalize list
                 self.finalize.append(template)
+                self.finalize_digests[digest] = template
+                self.template_names[template] = self.template_names.get(elem)
 
                 # Add that we've found a template for this include
                 found_template_includes.append(include_name)
 
+            self.add_to_report(elem, started, tested=1, matched=1,
+                               dedupe_hits=int(previous is not None))
+
         return num_templates
 
-    @staticmethod
-    def check_condition(condition, items):
-        # Check if a particular condition is matched for an 'other' template
-        if "tag" not in condition.attrib:
-            # Tag attrib is required
-            return False
+    def render_other(self, elem, include_name, properties):
+        # Build an 'other' template with the properties of a matched item, and return it with
+        # a digest of its include name, controls and variables
+        template = ETree.Element(elem.tag, elem.attrib)
+        template.text = elem.text
+        template.tail = elem.tail
+
+        # If the last build built this template with the same properties, use what it built
+        memo_key = self.get_memo_key(elem, (include_name, sorted(properties.items())))
+        built = self.memo.get(memo_key)
+        if built is not None:
+            self.add_to_report(elem, memo_hits=1)
+
+        # Only the controls and variables are built from the properties, so the rest of the
+        # template (conditions, properties and so on) is shared rather than copied. write_others
+        # copies the whole template before making any changes to it
+        for child in elem:
+            if child.tag not in ("controls", "variables"):
+                template.append(child)
+            elif built is not None:
+                template.append(self.tree_from_memo(built[child.tag]))
+            else:
+                template.append(self.copy_tree(child))
 
-        tag = condition.attrib.get("tag")
+        # Do any replacements - EXCEPT for visibility, which we'll store for later
+        # (in case multiple items would have an identical template
+        if built is None:
+            self.replace_elements(template.find("controls"), None, None, [], properties)
+            self.replace_elements(template.find("variables"), None, None, [], properties)
 
-        attrib = None
-        if "attribute" in condition.attrib:
-            attrib = condition.attrib.get("attribute").split("|")
+            built = {}
+            for child in template:
+                if child.tag in ("controls", "variables"):
+                    built[child.tag] = self.tree_to_memo(child)
 
-        # Find all elements with matching tag
-        for item in items.findall(tag):
-            if attrib is not None:
-                if attrib[0] not in item.attrib:
-                    # Doesn't have the attribute we're looking for
-                    continue
+        self.memo_used[memo_key] = built
 
-                if attrib[1] != item.attrib.get(attrib[0]):
-                    # This property doesn't match
-                    continue
+        include_name_check = include_name
+        if include_name is None:
+            include_name_check = "NONE"
 
-            if condition.text is not None and item.text != condition.text:
-                # This property doesn't match
+        digest = (include_name_check, self.get_tree_digest(template.find("controls")),
+                  self.get_tree_digest(template.find("variables")))
+
+        return template, digest
+
+    def get_render_key(self, template, items, properties, visibility_condition,
+                       profile_visibility):
+        # Returns a key for what a mainmenu or submenu template builds from a set of items.
+        # The items for each profile normally only differ by a <visible /> matching the profile
+        # visibility, which is removed as the items are added to the template - so those are left
+        # out, unless the templates custom items could match against them
+        item_digests = []
+        for item in items:
+            if item.tag != "item":
+                item_digests.append(self.get_tree_digest(item))
                 continue
 
-            # The rule has been matched :)
-            return True
+            item_digests.append((item.tag, item.text, item.tail, frozenset(item.attrib.items()),
+                                 tuple(self.get_tree_digest(child) for child in item
+                                       if child.tag != "visible" or
+                                       child.text != profile_visibility)))
+
+        profile_key = None
+        for item_template in template.findall("items"):
+            for _, match_type, rules in self.get_property_rules(item_template):
+                if match_type in ("any", "all") and \
+                        any(rule[0] == "visible" or SIMPLE_TAG.match(rule[0]) is None
+                            for rule in rules):
+                    profile_key = profile_visibility
+
+        return (template, visibility_condition, frozenset(properties.items()),
+                tuple(item_digests), profile_key)
+
+    def get_conditions(self, elem):
+        # Returns the match type and conditions of an 'other' template, compiling
+        # them the first time they're asked for
+        if elem in self.compiled_conditions:
+            return self.compiled_conditions[elem]
+
+        # Check whether the skinner has set the match type
+        # (whether all conditions need to match, or any)
+        match_type = "all"
+        match_elem = elem.find("match")
+        if match_elem is not None:
+            match_type = match_elem.text.lower()
+            if match_type not in ["any", "all"]:
+                log("Invalid <match /> element in template")
+                match_type = "all"
+
+        conditions = []
+        for condition in elem.findall("condition"):
+            if "tag" not in condition.attrib:
+                # Tag attrib is required, so this condition can never match
+                conditions.append((None, None, None))
+                continue
 
-        return False
+            attrib = None
+            if "attribute" in condition.attrib:
+                attrib = condition.attrib.get("attribute").split("|")
+                if len(attrib) != 2:
+                    log("Invalid attribute in template condition")
+                    conditions.append((None, None, None))
+                    continue
 
-    def get_properties(self, elem, items):
-        # Get any properties specified in an 'other' template
-        properties = {}
+            conditions.append((condition.attrib.get("tag"), attrib, condition.text))
+
+        self.compiled_conditions[elem] = (match_type, conditions)
+        return match_type, conditions
+
+    def get_property_rules(self, elem):
+        # Returns the properties that can be set from a template, compiling them the first
+        # time they're asked for. Each property is a tuple of its name, how it's matched
+        # ("value", "mainmenuid", "any" or "all"), and what it's matched with
+        if elem in self.compiled_properties:
+            return self.compiled_properties[elem]
+
+        compiled = []
 
         # Start by finding all properties defined directly in the template
         search_properties = elem.findall("property")
 
         # Add any properties defined in a property group
         for property_group in elem.findall("propertyGroup"):
-            for search_group in self.tree.findall("propertyGroup"):
-                if property_group.text.lower() == search_group.attrib.get("name").lower():
-                    search_properties += search_group.findall("property")
+            if property_group.text:
+                search_properties += self.property_groups.get(property_group.text.lower(), [])
 
         # Loop through all the properties
         for prop in search_properties:
-            if "name" not in prop.attrib or prop.attrib.get("name") in properties:
-                # Name attrib required, or we've already got a property with this name
+            if "name" not in prop.attrib:
+                # Name attrib required
                 continue
 
             name = prop.attrib.get("name")
 
-            #  Pull out the tag, attribute and value attribs into an array of tuples
+            #  Pull out the tag, attribute and value attribs into an array of tuples
             rules = []
             match_any = True
             property_value = None
@@ -643,6 +813,9 @@ class Template:
 
                 if "attribute" in single_match.attrib:
                     attribute = single_match.attrib.get("attribute").split("|")
+                    if len(attribute) != 2:
+                        log("Invalid attribute in template property rule")
+                        continue
 
                 if "value" in single_match.attrib:
                     value = single_match.attrib.get("value").split("|")
@@ -655,119 +828,106 @@ class Template:
 
             # If we haven't grabbed anything to match against yet
             if len(rules) == 0:
-                if "tag" in prop.attrib:
-                    tag = prop.attrib.get("tag")
-
-                    # Special case for the ID of the main menu item
-                    if tag.lower() == "mainmenuid":
-                        properties[name] = items.attrib.get("id")
-                        continue
+                if "tag" not in prop.attrib:
+                    # No tag property, so this will always match (so let's just use it!)
+                    compiled.append((name, "value", prop.text or ""))
+                    continue
 
-                    # Pull out the properties we'll match against
-                    attribute = None
-                    value = None
-                    property_value = None
+                tag = prop.attrib.get("tag")
 
-                    if "attribute" in prop.attrib:
-                        attribute = prop.attrib.get("attribute").split("|")
+                # Special case for the ID of the main menu item
+                if tag.lower() == "mainmenuid":
+                    compiled.append((name, "mainmenuid", None))
+                    continue
 
-                    if "value" in prop.attrib:
-                        value = prop.attrib.get("value").split("|")
+                # Pull out the properties we'll match against
+                attribute = None
+                value = None
+                property_value = None
 
-                    if prop.text:
-                        property_value = prop.text
+                if "attribute" in prop.attrib:
+                    attribute = prop.attrib.get("attribute").split("|")
+                    if len(attribute) != 2:
+                        log("Invalid attribute in template property")
+                        continue
 
-                    rules.append((tag, attribute, value, property_value))
+                if "value" in prop.attrib:
+                    value = prop.attrib.get("value").split("|")
 
-                else:
-                    # No tag property, so this will always match (so let's just use it!)
-                    if prop.text:
-                        properties[name] = prop.text
-                    else:
-                        properties[name] = ""
+                if prop.text:
+                    property_value = prop.text
 
-                    continue
+                rules.append((tag, attribute, value, property_value))
 
             if match_any:
-                # Match the property if any of the rules match
-                matched_rule = False
-                for rule in rules:
-                    if matched_rule:
-                        break
+                compiled.append((name, "any", rules))
+            else:
+                compiled.append((name, "all", rules))
+
+        self.compiled_properties[elem] = compiled
+        return compiled
+
+    def get_properties(self, elem, items, features=None):
+        # Get any properties specified in an 'other' template
+        properties = {}
+
+        if features is None:
+            features = ItemFeatures(items)
 
-                    # Let's get looking for any items that match
-                    tag = rule[0]
-                    attrib = rule[1]
-                    value = rule[2]
+        for name, match_type, rules in self.get_property_rules(elem):
+            if name in properties:
+                # We've already got a property with this name
+                continue
 
-                    for item in items.findall(tag):
-                        if attrib is not None:
-                            if attrib[0] not in item.attrib:
-                                # Doesn't have the attribute we're looking for
-                                continue
+            if match_type == "value":
+                properties[name] = rules
 
-                            if attrib[1] != item.attrib.get(attrib[0]):
-                                # The attributes value doesn't match
-                                continue
+            elif match_type == "mainmenuid":
+                properties[name] = items.attrib.get("id")
 
-                        if not item.text:
+            elif match_type == "any":
+                # Match the property if any of the rules match
+                for tag, attrib, value, property_value in rules:
+                    for text in features.texts(tag, attrib):
+                        if not text:
                             # The item doesn't have a value to match
                             continue
 
-                        if value is not None and item.text not in value:
+                        if value is not None and text not in value:
                             # The value doesn't match
                             continue
 
                         # We've matched a property :)
-                        if rule[3] is not None:
-                            properties[name] = rule[3]
+                        if property_value is not None:
+                            properties[name] = property_value
                         else:
-                            properties[name] = item.text
+                            properties[name] = text
 
                         break
 
             else:
-                # Match the property only if all the rules match
+                # Match the property only if all the rules match - every element
+                # with the rules tag has the attribute, and a value that matches
                 matched_rule = True
-                matched_value = []
-                for rule in rules:
-                    if not matched_rule:
-                        matched_value = []
-                        break
-
-                    # Let's get looking for any items that match
-                    tag = rule[0]
-                    attrib = rule[1]
-                    value = rule[2]
-                    matched_value = rule
-
-                    for item in items.findall(tag):
-                        log(repr(attrib))
-                        if attrib is not None:
-                            if attrib[0] not in item.attrib:
-                                # Doesn't have the attribute we're looking for
-                                matched_rule = False
-                                continue
-
-                            if attrib[1] != item.attrib.get(attrib[0]):
-                                # The attributes value doesn't match,
-                                # so we don't want to check the rule against it
-                                continue
-
-                        if not item.text:
-                            # The item doesn't have a value to match
+                for tag, attrib, value, _ in rules:
+                    texts = features.texts(tag, attrib)
+                    if attrib is not None and \
+                            len(features.texts(tag, attrib[:1])) != len(features.texts(tag)):
+                        # Doesn't have the attribute we're looking for
+                        matched_rule = False
+
+                    for text in texts:
+                        if not text or (value is not None and text not in value):
+                            # The item doesn't have a value, or it doesn't match
                             matched_rule = False
-                            continue
 
-                        if value is not None and item.text not in value:
-                            # The value doesn't match
-                            matched_rule = False
-                            continue
+                    if not matched_rule:
+                        break
 
                 if matched_rule:
                     # We've matched a property :)
-                    if matched_value[3] is not None:
-                        properties[name] = matched_value[3]
+                    if rules[-1][3] is not None:
+                        properties[name] = rules[-1][3]
                     else:
                         # This method only supports setting the property value directly,
                         # so if it wasn't specified, include a log error
@@ -795,13 +955,18 @@ class Template:
         if tree is None:
             return
 
-        for elem in tree:
+        # Build the new list of children in a single pass, and set it on the tree once at the end.
+        # Where an element is replaced, the first replacement is kept as it is and the rest are
+        # processed in turn. Where an element is removed without a replacement, the element
+        # following it is kept as it is
+        children = []
+        pending = deque(tree)
+        while pending:
+            elem = pending.popleft()
+
             # <tag skinshortcuts="visible" /> -> <tag condition="[condition]" />
             if "skinshortcuts" in elem.attrib:
-                # Get index of the element
-                index = list(tree).index(elem)
-
-                # Get existing attributes, text and tag
+                # Get existing attributes
                 attribs = []
                 item_type = ""
                 for single_attrib in elem.attrib:
@@ -810,164 +975,404 @@ class Template:
                     else:
                         attribs.append((single_attrib, elem.attrib.get(single_attrib)))
 
-                text = elem.text
-                tag = elem.tag
-
                 # Don't continue is item_type = visibility, and no visibilityCondition
                 if item_type == "visibility" and visibility_condition is None:
+                    children.append(elem)
                     continue
 
-                # Remove the existing element
-                tree.remove(elem)
-
                 # Make replacement element
-                new_element = ETree.Element(tag)
-                if text is not None:
-                    new_element.text = text
+                new_element = ETree.Element(elem.tag)
+                if elem.text is not None:
+                    new_element.text = elem.text
 
                 for single_attrib in attribs:
                     new_element.set(single_attrib[0], single_attrib[1])
 
                 # Make replacements
-                if item_type == "visibility" and visibility_condition is not None:
+                if item_type == "visibility":
                     new_element.set("condition", visibility_condition)
 
-                # Insert it
-                tree.insert(index, new_element)
+                self.replace_child(children, pending, [new_element])
+                continue
 
             # <tag>$skinshortcuts[var]</tag> -> <tag>[value]</tag>
             # <tag>$skinshortcuts[var]</tag> ->
             # <tag><include>[includeName]</include></tag> (property = $INCLUDE[includeName])
-            if elem.text is not None:
-                while "$SKINSHORTCUTS[" in elem.text:
-                    # Split the string into its composite parts
-                    string_start = elem.text.split("$SKINSHORTCUTS[", 1)
-                    string_end = string_start[1].split("]", 1)
-                    # string_start[ 0 ] = Any code before the $SKINSHORTCUTS property
-                    # string_end[ 0 ] = The name of the $SKINSHORTCUTS property
-                    # string_end[ 1 ] = Any code after the $SKINSHORTCUTS property
-
-                    if string_end[0] in properties:
-                        if properties[string_end[0]].startswith("$INCLUDE["):
-                            # Remove text property
-                            elem.text = ""
-                            # Add include element
-                            include_element = ETree.SubElement(elem, "include")
-                            include_element.text = properties[string_end[0]][9:-1]
-
-                        else:
-                            elem.text = string_start[0] + properties[string_end[0]] + string_end[1]
-
-                    else:
-                        elem.text = string_start[0] + string_end[1]
+            if elem.text is not None and "$SKINSHORTCUTS[" in elem.text:
+                self.replace_skinshortcuts_text(elem, properties)
 
             # <tag attrib="$skinshortcuts[var]" /> -> <tag attrib="[value]" />
             for attrib in elem.attrib:
                 value = elem.attrib.get(attrib)
-                while "$SKINSHORTCUTS[" in elem.attrib.get(attrib):
-                    # Split the string into its composite parts
-                    string_start = elem.attrib.get(attrib).split("$SKINSHORTCUTS[", 1)
-                    string_end = string_start[1].split("]", 1)
-
-                    if string_end[0] in properties:
-                        elem.set(attrib,
-                                 string_start[0] + properties[string_end[0]] + string_end[1])
-                    else:
-                        elem.set(attrib, string_start[0] + string_end[1])
+                if "$SKINSHORTCUTS[" not in value:
+                    continue
+
+                elem.set(attrib, self.replace_skinshortcuts_string(value, properties))
 
                 if value.startswith("$SKINSHORTCUTS[") and value[15:-1] in properties:
-                    new_value = ""
-                    if value[15:-1] in properties:
-                        new_value = properties[value[15:-1]]
-                    elem.set(attrib, new_value)
+                    elem.set(attrib, properties[value[15:-1]])
 
             # <tag>$PYTHON[var]</tag> -> <tag>[result]</tag>
-            if elem.text is not None:
-                while "$PYTHON[" in elem.text:
-                    # Split the string into its composite parts
-                    string_start = elem.text.split("$PYTHON[", 1)
-                    string_end = string_start[1].split("]", 1)
-                    # string_start[ 0 ] = Any code before the $MATHS property
-                    # string_end[ 0 ] = The maths to be performed
-                    # string_end[ 1 ] = Any code after the $MATHS property
-
-                    string_end[0] = simple_eval("%s" % (string_end[0]), names=properties)
-
-                    elem.text = string_start[0] + str(string_end[0]) + string_end[1]
+            if elem.text is not None and "$PYTHON[" in elem.text:
+                elem.text = self.replace_python_string(elem.text, properties)
 
             # <tag attrib="$PYTHON[var]" /> -> <tag attrib="[value]" />
             for attrib in elem.attrib:
-                _ = elem.attrib.get(attrib)
-                while "$PYTHON[" in elem.attrib.get(attrib):
-                    # Split the string into its composite parts
-                    string_start = elem.attrib.get(attrib).split("$PYTHON[", 1)
-                    string_end = string_start[1].split("]", 1)
-
-                    string_end[0] = simple_eval("%s" % (string_end[0]), names=properties)
+                value = elem.attrib.get(attrib)
+                if "$PYTHON[" in value:
+                    elem.set(attrib, self.replace_python_string(value, properties))
 
-                    elem.set(attrib, string_start[0] + str(string_end[0]) + string_end[1])
+            if elem.tag != "skinshortcuts":
+                # Iterate through tree
+                self.replace_elements(elem, visibility_condition, profile_visibility, items,
+                                      properties, customitems=customitems)
+                children.append(elem)
+                continue
 
             # <skinshortcuts>visible</skinshortcuts> -> <visible>[condition]</visible>
             # <skinshortcuts>items</skinshortcuts> -> <item/><item/>...
-            if elem.tag == "skinshortcuts":
-                # Get index of the element
-                index = list(tree).index(elem)
 
-                # Get the item_type of replacement
-                item_type = elem.text
+            # Get the item_type of replacement
+            item_type = elem.text
 
-                # Don't continue is item_type = visibility, and no visibilityCondition
-                if item_type == "visibility" and visibility_condition is None:
+            # Don't continue is item_type = visibility, and no visibilityCondition
+            if item_type == "visibility" and visibility_condition is None:
+                children.append(elem)
+                continue
+
+            # Make replacements
+            newelements = []
+            if item_type == "visibility":
+                # Create a new visible element
+                newelement = ETree.Element("visible")
+                newelement.text = visibility_condition
+                newelements.append(newelement)
+
+            elif item_type == "items" and customitems is not None and \
+                    elem.attrib.get("insert"):
+                # Each items controls are inserted last to first
+                for element in self.build_submenu_custom_items(customitems,
+                                                               items.findall("item"),
+                                                               elem.attrib.get("insert"),
+                                                               properties):
+                    newelements.extend(reversed(element))
+
+            elif item_type == "items":
+                # Create a list of all items, without their existing visible element,
+                # if it matches our visibilityCondition
+                if len(items) == 0:
+                    # Leave the rest of the elements as they are
+                    children.extend(pending)
+                    break
+
+                for item in items.findall("item"):
+                    newitem = self.copy_tree(item)
+
+                    # Remove the existing visible elem from this
+                    for visibility in newitem.findall("visible"):
+                        if visibility.text != profile_visibility:
+                            continue
+                        newitem.remove(visibility)
+
+                    # Add a copy to the list
+                    newelements.append(newitem)
+
+            self.replace_child(children, pending, newelements)
+
+        tree[:] = children
+
+    @staticmethod
+    def replace_child(children, pending, newelements):
+        # Replace an element being rebuilt by replace_elements with newelements
+        if len(newelements) != 0:
+            children.append(newelements[0])
+            pending.extendleft(reversed(newelements[1:]))
+
+        elif len(pending) != 0:
+            children.append(pending.popleft())
+
+    def add_to_report(self, template, started=None, **counts):
+        # Add the time since started, and the counts, to the report for a template
+        if self.report is None:
+            return
+
+        name = self.template_names.get(template)
+        if name not in self.report:
+            self.report[name] = {"time": 0.0, "tested": 0, "matched": 0, "dedupe_hits": 0,
+                                 "memo_hits": 0, "controls": 0}
+
+        if started is not None:
+            self.report[name]["time"] += time.time() - started
+
+        for count, value in counts.items():
+            self.report[name][count] += value
+
+    def write_report(self, includes_path):
+        # Write the report next to an includes file
+        if self.report is None:
+            return
+
+        path = os.path.join(os.path.dirname(includes_path),
+                            "script-skinshortcuts-template-report.json")
+        try:
+            write_file(path, json.dumps(self.report, indent=4))
+        except:
+            log(traceback.print_exc())
+            log("Failed to write template report to %s" % path)
+
+    def get_memo_key(self, template, inputs, digests=()):
+        # Returns a key for what a template builds from its inputs (and the tree digests of any
+        # items) which is the same from one build to the next - unlike the hash of the template
+        # element, or the order of the attributes in a digest
+        def stable(digest):
+            tag, text, tail, attrib, children = digest
+            return tag, text, tail, sorted(attrib), [stable(child) for child in children]
+
+        payload = repr((self.template_names.get(template), inputs,
+                        [stable(digest) for digest in digests]))
+        return hashlib.md5(payload.encode("utf-8")).hexdigest()
+
+    def tree_to_memo(self, elem):
+        # Returns an element as a list which can be saved as JSON, keeping the text, tail and
+        # attribute order exactly as they are
+        return [elem.tag, elem.text, elem.tail, list(elem.attrib.items()),
+                [self.tree_to_memo(child) for child in elem]]
+
+    def tree_from_memo(self, memo):
+        # Rebuilds an element saved by tree_to_memo
+        tag, text, tail, attrib, children = memo
+        elem = ETree.Element(tag, dict(attrib))
+        elem.text = text
+        elem.tail = tail
+
+        for child in children:
+            elem.append(self.tree_from_memo(child))
+
+        return elem
+
+    def read_memo(self):
+        # Load what the last build built, if it was with the same template.xml (and version of
+        # the script)
+        if not xbmcvfs.exists(TEMPLATE_MEMO_FILE):
+            return {}
+
+        try:
+            payload = json.loads(read_file(TEMPLATE_MEMO_FILE))
+            if payload.get("version") == ADDON_VERSION and \
+                    payload.get("template") == generate_file_hash(self.templatepath):
+                return payload.get("fragments", {})
+        except:
+            log(traceback.print_exc())
+            log("Unable to parse %s" % TEMPLATE_MEMO_FILE)
+
+        return {}
+
+    def write_memo(self):
+        # Save what this build built (or reused), for the next build
+        if self.tree is None:
+            return
+
+        try:
+            payload = json.dumps({
+                "version": ADDON_VERSION,
+                "template": generate_file_hash(self.templatepath),
+                "fragments": self.memo_used
+            })
+            write_file(TEMPLATE_MEMO_FILE, payload)
+        except:
+            log(traceback.print_exc())
+            log("Failed to write template memo to %s" % TEMPLATE_MEMO_FILE)
+
+    def compile_template(self):
+        # Locate the placeholders in every string of the template once, so that building
+        # each menu and 'other' template can substitute them without re-scanning the strings
+        for elem in self.tree.iter():
+            for string in [elem.text] + list(elem.attrib.values()):
+                if string is None:
                     continue
 
-                # Remove the existing element
-                tree.remove(elem)
+                for marker in ("$SKINSHORTCUTS[", "$PYTHON["):
+                    if marker in string:
+                        self.compiled_strings[(marker, string)] = self.split_string(string,
+                                                                                    marker)
 
-                # Make replacements
-                if item_type == "visibility" and visibility_condition is not None:
-                    # Create a new visible element
-                    newelement = ETree.Element("visible")
-                    newelement.text = visibility_condition
-                    # Insert it
-                    tree.insert(index, newelement)
-
-                elif item_type == "items" and customitems is not None and \
-                        elem.attrib.get("insert"):
-                    for element in self.build_submenu_custom_items(customitems,
-                                                                   items.findall("item"),
-                                                                   elem.attrib.get("insert"),
-                                                                   properties):
-                        for child in element:
-                            tree.insert(index, child)
-
-                elif item_type == "items":
-                    # Firstly, go through and create an array of all items in reverse order, without
-                    # their existing visible element, if it matches our visibilityCondition
-                    newelements = []
-                    if not items:
-                        break
+        # Gather the properties of each property group (groups sharing a name are combined,
+        # in the order they're defined)
+        for property_group in self.tree.findall("propertyGroup"):
+            if "name" not in property_group.attrib:
+                log("Invalid template - propertyGroup without a name")
+                continue
+
+            self.property_groups.setdefault(property_group.attrib.get("name").lower(),
+                                            []).extend(property_group.findall("property"))
+
+        # And flatten the properties (including those from property groups) of every template
+        for template_type in ("mainmenu", "submenu", "other", "submenuOther"):
+            for count, template in enumerate(self.tree.findall(template_type)):
+                self.template_names[template] = "%s %d %s" % (template_type, count + 1,
+                                                              json.dumps(template.attrib))
+                self.get_property_rules(template)
+                for item_template in template.findall("items"):
+                    self.get_property_rules(item_template)
 
-                    for item in items.findall("item"):
-                        newitem = self.copy_tree(item)
+    def compile_string(self, string, marker):
+        # Returns a string split by split_string. Strings from template.xml were split when it
+        # was loaded - those created while building (by substituting an items properties) are
+        # rarely seen twice, so aren't kept
+        key = (marker, string)
+        if key in self.compiled_strings:
+            return self.compiled_strings[key]
 
-                        # Remove the existing visible elem from this
-                        for visibility in newitem.findall("visible"):
-                            if visibility.text != profile_visibility:
-                                continue
-                            newitem.remove(visibility)
+        return self.split_string(string, marker)
 
-                        # Add a copy to the array
-                        newelements.insert(0, newitem)
+    @staticmethod
+    def split_string(string, marker):
+        # Splits a string into the literal text around each placeholder of the given marker
+        # and the contents of those placeholders, in the same order the replacement loops
+        # would find them. Returns None if a placeholder isn't closed
+        literals = []
+        contents = []
+        remaining = string
+        while marker in remaining:
+            string_start = remaining.split(marker, 1)
+            string_end = string_start[1].split("]", 1)
+            if len(string_end) != 2:
+                # Unclosed placeholder - leave it to the replacement loops
+                literals = None
+                break
 
-                    if len(newelements) != 0:
-                        for element in newelements:
-                            # Insert them into the template
-                            tree.insert(index, element)
+            literals.append(string_start[0])
+            contents.append(string_end[0])
+            remaining = string_end[1]
+
+        compiled = None
+        if literals is not None:
+            literals.append(remaining)
+            compiled = (literals, contents)
+
+        return compiled
+
+    def replace_skinshortcuts_text(self, elem, properties):
+        # Replace $SKINSHORTCUTS[] placeholders in an elements text, or replace the text with
+        # an <include /> if the property is an $INCLUDE[]
+        compiled = self.compile_string(elem.text, "$SKINSHORTCUTS[")
+        if compiled is not None:
+            literals, names = compiled
+            text = literals[0]
+            for name, literal in zip(names, literals[1:]):
+                if name in properties:
+                    if properties[name].startswith("$INCLUDE["):
+                        if "$SKINSHORTCUTS[" in text:
+                            # A property brought in another placeholder
+                            break
+
+                        # Remove text property
+                        elem.text = ""
+                        # Add include element
+                        include_element = ETree.SubElement(elem, "include")
+                        include_element.text = properties[name][9:-1]
+                        return
+
+                    text += properties[name]
+
+                text += literal
 
             else:
-                # Iterate through tree
-                self.replace_elements(elem, visibility_condition, profile_visibility, items,
-                                      properties, customitems=customitems)
+                if "$SKINSHORTCUTS[" not in text:
+                    elem.text = text
+                    return
+
+        # A property brought in another placeholder (or one isn't closed), so replace them
+        # one at a time
+        while "$SKINSHORTCUTS[" in elem.text:
+            # Split the string into its composite parts
+            string_start = elem.text.split("$SKINSHORTCUTS[", 1)
+            string_end = string_start[1].split("]", 1)
+            # string_start[ 0 ] = Any code before the $SKINSHORTCUTS property
+            # string_end[ 0 ] = The name of the $SKINSHORTCUTS property
+            # string_end[ 1 ] = Any code after the $SKINSHORTCUTS property
+
+            if string_end[0] in properties:
+                if properties[string_end[0]].startswith("$INCLUDE["):
+                    # Remove text property
+                    elem.text = ""
+                    # Add include element
+                    include_element = ETree.SubElement(elem, "include")
+                    include_element.text = properties[string_end[0]][9:-1]
+
+                else:
+                    elem.text = string_start[0] + properties[string_end[0]] + string_end[1]
+
+            else:
+                elem.text = string_start[0] + string_end[1]
+
+    def replace_skinshortcuts_string(self, string, properties):
+        # Returns a string with its $SKINSHORTCUTS[] placeholders replaced
+        compiled = self.compile_string(string, "$SKINSHORTCUTS[")
+        if compiled is not None:
+            literals, names = compiled
+            result = literals[0]
+            for name, literal in zip(names, literals[1:]):
+                if name in properties:
+                    result += properties[name]
+                result += literal
+
+            if "$SKINSHORTCUTS[" not in result:
+                return result
+
+        # A property brought in another placeholder (or one isn't closed), so replace them
+        # one at a time
+        while "$SKINSHORTCUTS[" in string:
+            # Split the string into its composite parts
+            string_start = string.split("$SKINSHORTCUTS[", 1)
+            string_end = string_start[1].split("]", 1)
+
+            if string_end[0] in properties:
+                string = string_start[0] + properties[string_end[0]] + string_end[1]
+            else:
+                string = string_start[0] + string_end[1]
+
+        return string
+
+    def replace_python_string(self, string, properties):
+        # Returns a string with its $PYTHON[] placeholders replaced with their results
+        compiled = self.compile_string(string, "$PYTHON[")
+        if compiled is not None:
+            literals, expressions = compiled
+            result = literals[0]
+            for expression, literal in zip(expressions, literals[1:]):
+                result += str(self.evaluate_python(expression, properties)) + literal
+
+            if "$PYTHON[" not in result:
+                return result
+
+        # A result brought in another placeholder (or one isn't closed), so replace them
+        # one at a time
+        while "$PYTHON[" in string:
+            # Split the string into its composite parts
+            string_start = string.split("$PYTHON[", 1)
+            string_end = string_start[1].split("]", 1)
+            # string_start[ 0 ] = Any code before the $MATHS property
+            # string_end[ 0 ] = The maths to be performed
+            # string_end[ 1 ] = Any code after the $MATHS property
+
+            string_end[0] = self.evaluate_python(string_end[0], properties)
+
+            string = string_start[0] + str(string_end[0]) + string_end[1]
+
+        return string
+
+    def evaluate_python(self, expression, properties):
+        # Evaluate a $PYTHON[] expression against an items properties, parsing each
+        # distinct expression only once
+        if expression not in self.parsed_expressions:
+            self.parsed_expressions[expression] = ast.parse(expression.strip()).body[0].value
+
+        # Only the items properties are names, even when it has none (as simple_eval was
+        # called with names=properties, its default names were never used)
+        self.simple_eval.names = properties
+        self.simple_eval.expr = expression
+        return self.simple_eval._eval(self.parsed_expressions[expression])  # pylint: disable=protected-access
 
     def build_submenu_custom_items(self, template, items, insert, current_properties):
         # Builds an 'items' template within a submenu template
@@ -990,7 +1395,7 @@ class Template:
                 new_element, None, None, [],
                 self.combine_properties(item_template, item, current_properties.copy())
             )
-            newelements.insert(0, new_element)
+            newelements.append(new_element)
 
         return newelements
 
@@ -1007,26 +1412,11 @@ class Template:
 
         return ret
 
-    def compare_tree(self, element_1, element_2):
-        if element_1 is None and element_2 is None:
-            return True
-
-        if element_1 is None or element_2 is None:
-            return False
-
-        if element_1.tag != element_2.tag:
-            return False
-
-        if element_1.text != element_2.text:
-            return False
-
-        if element_1.tail != element_2.tail:
-            return False
-
-        if element_1.attrib != element_2.attrib:
-            return False
-
-        if len(element_1) != len(element_2):
-            return False
+    def get_tree_digest(self, elem):
+        # Returns a hashable digest of an element and its children. Two elements have the same
+        # digest if their tags, text, tails, attributes and children are all the same
+        if elem is None:
+            return None
 
-        return all(self.compare_tree(c1, c2) for c1, c2 in zip(element_1, element_2))
+        return (elem.tag, elem.text, elem.tail, frozenset(elem.attrib.items()),
+                tuple(self.get_tree_digest(child) for child in elem))
@@ -18,6 +18,7 @@ import xbmcvfs
 
 from . import datafunctions
 from . import template
+from .catalogue_utils import update_catalogue
 from .common import log
 from .common import read_file
 from .common_utils import disable_logging
@@ -29,6 +30,7 @@ from .constants import ADDON_VERSION
 from .constants import HOME_WINDOW
 from .constants import KODI_VERSION
 from .constants import LANGUAGE
+from .constants import MASTER_CATALOGUE_FILE
 from .constants import SKIN_DIR
 from .constants import SKIN_PATH
 from .hash_utils import generate_file_hash
@@ -317,6 +319,8 @@ class XMLFunctions:
         temple_object = template.Template()
         temple_object.includes = root
         temple_object.progress = progress
+        if ADDON.getSettingBool("template_report"):
+            temple_object.report = {}
 
         # Get any shortcuts we're checking for
         self.check_for_shortcuts = []
@@ -333,25 +337,22 @@ class XMLFunctions:
                  "False")
             )
 
-        mainmenu_tree = ETree.SubElement(root, "include")
-        mainmenu_tree.set("name", "skinshortcuts-mainmenu")
+        mainmenu_tree = temple_object.add_include("skinshortcuts-mainmenu")
 
         submenu_trees = []
         for level in range(0, int(num_levels) + 1):
             _ = ETree.SubElement(root, "include")
-            subtree = ETree.SubElement(root, "include")
             if level == 0:
-                subtree.set("name", "skinshortcuts-submenu")
+                subtree = temple_object.add_include("skinshortcuts-submenu")
             else:
-                subtree.set("name", "skinshortcuts-submenu-%s" % str(level))
+                subtree = temple_object.add_include("skinshortcuts-submenu-%s" % str(level))
 
             if subtree not in submenu_trees:
                 submenu_trees.append(subtree)
 
         allmenu_tree = []
         if build_mode == "single":
-            allmenu_tree = ETree.SubElement(root, "include")
-            allmenu_tree.set("name", "skinshortcuts-allmenus")
+            allmenu_tree = temple_object.add_include("skinshortcuts-allmenus")
 
         profile_percent = 100 / len(profilelist)
         profile_count = -1
@@ -496,9 +497,6 @@ class XMLFunctions:
                             justmenu_tree_b = submenu_nodes[submenu][1]
                         else:
                             # Create these nodes
-                            justmenu_tree_a = ETree.SubElement(root, "include")
-                            justmenu_tree_b = ETree.SubElement(root, "include")
-
                             if count != 0:
                                 group_include = \
                                     "%s-%s" % \
@@ -507,10 +505,12 @@ class XMLFunctions:
                             else:
                                 group_include = self.data_func.slugify(submenu, convert_int=True)
 
-                            justmenu_tree_a.set("name",
-                                                "skinshortcuts-group-%s" % group_include)
-                            justmenu_tree_b.set("name",
-                                                "skinshortcuts-group-alt-%s" % group_include)
+                            justmenu_tree_a = temple_object.add_include(
+                                "skinshortcuts-group-%s" % group_include
+                            )
+                            justmenu_tree_b = temple_object.add_include(
+                                "skinshortcuts-group-alt-%s" % group_include
+                            )
 
                             submenu_nodes[submenu] = [justmenu_tree_a, justmenu_tree_b]
 
@@ -755,6 +755,8 @@ class XMLFunctions:
                     tree.write(path, encoding="UTF-8")  # writing includes
                     hashable.add(path)
 
+                    temple_object.write_report(path)
+
         hashable.update(self.data_func.hashable)
         hashable.update(temple_object.hashable)
 
@@ -763,8 +765,10 @@ class XMLFunctions:
             if hexdigest:
                 hashlist.append([item, hexdigest])
 
-        # Save the hashes
+        # Save the hashes, and record the skin in the catalogue
         write_hashes(hashlist)
+        temple_object.write_memo()
+        update_catalogue(hashlist, MASTER_CATALOGUE_FILE)
 
     def build_element(self, item, group_name, visibility_condition, profile_visibility,
                       submenu_visibility=None, itemid=-1, mainmenuid=None, options=None):